@@ -19,6 +19,7 @@ setup(
             'sgpublish-create = sgpublish.commands.create:main', # Deprecated.
             'publish_generic = sgpublish.commands.create:main', # Deprecated.
             'publish-generic = sgpublish.commands.create:main',
+            'sgpublish-gc = sgpublish.commands.gc:main',
         ],
     },
     
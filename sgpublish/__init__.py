@@ -1,2 +1,3 @@
 from .publisher import Publisher
 
+from .batch import PublisherBatch, publish_many
@@ -13,6 +13,7 @@ import sgfs.ui.picker.utils as picker_utils
 
 from sgpublish import utils
 from sgpublish import uiutils as ui_utils
+from sgpublish.manifest import Manifest
 
 
 class Dialog(QtGui.QDialog):
@@ -112,8 +113,19 @@ class Dialog(QtGui.QDialog):
         
     
     def _on_copy(self):
+
+        # Make sure the publish is intact before the artist starts working on it.
+        src_path = self._publish['sg_path']
+        manifest = Manifest.find(src_path)
+        problems = manifest.verify([src_path]) if manifest else None
+        if problems:
+            QtGui.QMessageBox.critical(self, 'Corrupt Publish', 'The publish is not intact:\n\n' + '\n'.join(
+                '%s: %s' % problem for problem in problems
+            ))
+            return
+
         path = self._namer._namer.get_path()
-        subprocess.call(['cp', self._publish['sg_path'], path])
+        subprocess.call(['cp', src_path, path])
         subprocess.call(['chmod', 'a+w', path])
         exit()
 
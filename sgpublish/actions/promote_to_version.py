@@ -4,30 +4,56 @@ import subprocess
 from sgfs import SGFS
 from sgactions.utils import notify
 
+from sgpublish import governor
 from sgpublish import versions
 
 
 def run(entity_type, selected_ids, **kwargs):
     sgfs = SGFS()
-    
-    for id_ in selected_ids:
-        
-        entity = sgfs.session.merge({'type': entity_type, 'id': id_})
-        task, code, version, frames_path, movie_path = entity.fetch(('sg_link', 'code', 'sg_version', 'sg_path_to_frames', 'sg_path_to_movie'))
-        
+
+    # One request for every publish.
+    publishes = [sgfs.session.merge({'type': entity_type, 'id': id_}) for id_ in selected_ids]
+    versions.fetch_promotion_fields(publishes)
+
+    problems = []
+    candidates = []
+    for publish in publishes:
+
+        code = '%s_v%04d' % (publish['code'], publish['sg_version'])
+
         # Can't promote it without a movie.
-        if not (frames_path or movie_path):
-            notify('Version "%s_v%04d" does not have frames or a movie' % (code, version), sticky=True)
-            continue
-        
-        # Make sure it doesn't already exist.
-        existing = sgfs.session.find('Version', [
-            ('sg_task', 'is', task),
-            ('code', 'is', '%s_v%04d' % (code, version)),
-        ])
-        if existing:
-            notify('Version "%s_v%04d" already exists' % (code, version), sticky=True)
+        if not (publish['sg_path_to_frames'] or publish['sg_path_to_movie']):
+            problems.append('Version "%s" does not have frames or a movie' % code)
             continue
-        
-        versions.promote_publish(entity)
-        notify('Promoted to version "%s_v%04d"' % (entity['code'], entity['sg_version']))    
+
+        candidates.append((publish, code))
+
+    # Make sure they don't already exist; one request for all of them.
+    existing = set()
+    if candidates:
+        for version in governor.call_idempotent(sgfs.session.find, 'Version', [
+            ('sg_task', 'in', [publish['sg_link'] for publish, _ in candidates]),
+            ('code', 'in', sorted(set(code for _, code in candidates))),
+        ], ['sg_task', 'code']):
+            existing.add((version['sg_task']['id'] if version['sg_task'] else None, version['code']))
+
+    to_promote = []
+    for publish, code in candidates:
+        if (publish['sg_link']['id'], code) in existing:
+            problems.append('Version "%s" already exists' % code)
+        else:
+            to_promote.append((publish, code))
+
+    versions.create_versions_from_publishes([publish for publish, _ in to_promote], sgfs=sgfs)
+
+    # One notification for the lot.
+    lines = []
+    if to_promote:
+        lines.append('Promoted %d version%s: %s' % (
+            len(to_promote),
+            's' if len(to_promote) != 1 else '',
+            ', '.join('"%s"' % code for _, code in to_promote),
+        ))
+    lines.extend(problems)
+    if lines:
+        notify('\n'.join(lines), sticky=bool(problems))
@@ -0,0 +1,296 @@
+"""Publishing many streams at once.
+
+Exporters which publish tens of streams together (e.g. one per render layer,
+or one cache per asset) can do so with a handful of Shotgun round-trips
+instead of several per publish::
+
+    >>> specs = [dict(link=task, type='maya_geocache', name=name) for name in names]
+    >>> with sgpublish.publish_many(specs) as batch:
+    ...     for name, publisher in zip(names, batch):
+    ...         publisher.add_file(cache_paths[name])
+
+"""
+
+import logging
+import time
+
+from sgfs import SGFS
+from sgsession import Entity
+
+from . import executors
+from . import governor
+from .publisher import Publisher, DEFAULT_COPY_WORKERS, copy_files, preflight, rollback_many, _idempotent_phases
+
+
+log = logging.getLogger(__name__)
+
+
+def publish_many(specs, **kwargs):
+    """Create a :class:`PublisherBatch`; see it for arguments."""
+    return PublisherBatch(specs, **kwargs)
+
+
+class PublisherBatch(object):
+
+    """Many :class:`.Publisher` objects which are created and committed together.
+
+    The latest version of each stream is looked up once (with the lookups
+    running concurrently), the first stage ``PublishEvent`` entities (and review Version stubs) are all
+    created in one ``batch`` request, and the second stage updates in another.
+    Files of every publish are copied through one shared pipeline.
+
+    Like a :class:`.Publisher`, this is a context manager which commits upon
+    success, and rolls back everything upon failure.
+
+    :param list specs: A list of dicts of keyword arguments for each
+        :class:`.Publisher`.
+    :param sgfs: The SGFS for all publishers. Will be pulled from the first
+        link's session if not provided.
+    :param int copy_workers: How many files to copy at once, across all
+        publishers.
+
+    """
+
+    def __init__(self, specs, sgfs=None, copy_workers=None):
+
+        specs = [dict(spec) for spec in specs]
+
+        if not sgfs:
+            sgfs = next((spec['sgfs'] for spec in specs if spec.get('sgfs')), None)
+        if not sgfs:
+            links = [spec.get('link') or spec.get('template') for spec in specs]
+            sessions = [x.session for x in links if isinstance(x, Entity)]
+            sgfs = SGFS(session=sessions[0]) if sessions else SGFS()
+        self.sgfs = sgfs
+
+        self.copy_workers = copy_workers or DEFAULT_COPY_WORKERS
+
+        self._committed = False
+
+        start_time = time.time()
+        queried = self._allocate_versions(specs)
+        lookup_time = time.time() - start_time
+
+        # Publishers which were constructed have reserved their directories.
+        self.publishers = []
+        try:
+            for spec in specs:
+                spec['sgfs'] = sgfs
+                spec['defer_entities'] = True
+                self.publishers.append(Publisher(**spec))
+        except:
+            self.rollback()
+            raise
+
+        if queried:
+            for publisher in self.publishers:
+                publisher._record_timing('version_lookup', lookup_time, 1)
+
+        try:
+            self._create_entities()
+        except:
+            self.rollback()
+            raise
+
+    def __iter__(self):
+        return iter(self.publishers)
+
+    def __len__(self):
+        return len(self.publishers)
+
+    def __getitem__(self, index):
+        return self.publishers[index]
+
+    def _allocate_versions(self, specs):
+        """Fill in the versions of every spec that needs one.
+
+        Each stream's latest version is queried once (concurrently), no matter
+        how many specs publish to it.
+
+        :returns: If Shotgun was queried.
+
+        """
+
+        session = self.sgfs.session
+
+        streams = {}
+        for spec in specs:
+            if spec.get('version') is not None or spec.get('template'):
+                continue
+            if not (spec.get('link') and spec.get('type') and spec.get('name')):
+                continue # Let the Publisher complain.
+            link = spec['link'] = session.merge(spec['link'])
+            key = (link['type'], link['id'], str(spec['type']), str(spec['name']))
+            streams.setdefault(key, []).append(spec)
+
+        if not streams:
+            return False
+
+        # The head of each stream, looked up concurrently. Every lookup is
+        # limited to the latest version, so this doesn't grow with history.
+        executor = executors.get('shotgun')
+        futures = {}
+        for key, specs_ in streams.iteritems():
+            futures[key] = executor.submit(governor.call_idempotent, session.find_one, 'PublishEvent', [
+                ('sg_link', 'is', specs_[0]['link']),
+                ('sg_type', 'is', key[2]),
+                ('code', 'is', key[3]),
+                ('sg_version', 'greater_than', 0),
+            ], ['sg_version', 'created_at'], order=[
+                {'field_name': 'sg_version', 'direction': 'desc'},
+                {'field_name': 'created_at', 'direction': 'desc'},
+            ])
+        heads = dict((key, future.result()) for key, future in futures.iteritems())
+
+        for key, specs_ in streams.iteritems():
+            head = heads.get(key)
+            version = head['sg_version'] + 1 if head else 1
+            # Several publishes to the same stream get sequential versions.
+            for spec in specs_:
+                spec['version'] = version
+                if head is not None:
+                    spec.setdefault('parent', head)
+                    head = None
+                version += 1
+
+        return True
+
+    def _create_entities(self):
+        """Create every first stage PublishEvent and review stub in one batch."""
+
+        requests = []
+        targets = []
+        for publisher in self.publishers:
+            if not publisher.entity['id']:
+                requests.append({
+                    'request_type': 'create',
+                    'entity_type': 'PublishEvent',
+                    'data': publisher._stage_one_data(),
+                })
+                targets.append((publisher, 'entity'))
+            if publisher._review_version_fields is not None and publisher._review_version_entity is None:
+                requests.append({
+                    'request_type': 'create',
+                    'entity_type': 'Version',
+                    'data': publisher._review_version_stub_data(),
+                })
+                targets.append((publisher, '_review_version_entity'))
+
+        if not requests:
+            return
+
+        session = self.sgfs.session
+        results = self._call_shotgun('create', self.publishers, session.batch, requests)
+        for (publisher, attr), entity in zip(targets, results):
+            setattr(publisher, attr, session.merge(entity))
+
+    def commit(self):
+
+        if self._committed:
+            raise ValueError('batch already comitted')
+        self._committed = True
+
+        for publisher in self.publishers:
+            if publisher._committed:
+                raise ValueError('publish already comitted')
+            publisher._committed = True
+            publisher._normalize_attributes()
+
+        # Fail before we touch Shotgun (or the directories) if they won't all fit.
+        start_time = time.time()
+        try:
+            preflight(self.publishers)
+        except:
+            rollback_many(self.publishers, discard_empty=True)
+            raise
+        for publisher in self.publishers:
+            publisher._record_timing('preflight', time.time() - start_time)
+
+        try:
+
+            updates = [publisher._prepare_commit() for publisher in self.publishers]
+            staged = [bool(publisher._staging_directory) for publisher in self.publishers]
+
+            executor = executors.get('shotgun')
+            futures = []
+
+            # Start the second stage of all non-staged publishes.
+            requests = [
+                self._update_request(publisher, updates_)
+                for publisher, updates_, staged_ in zip(self.publishers, updates, staged)
+                if not staged_
+            ]
+            if requests:
+                futures.append(executor.submit(self._call_shotgun, 'update',
+                    [p for p, s in zip(self.publishers, staged) if not s],
+                    self.sgfs.session.batch, requests,
+                ))
+
+            for publisher in self.publishers:
+                if publisher.thumbnail_path:
+                    futures.append(executor.submit(publisher._upload_thumbnail))
+
+            copy_files(self.publishers, self.copy_workers)
+            for publisher in self.publishers:
+                publisher._finish_files()
+
+            for future in futures:
+                future.result()
+
+            for publisher in self.publishers:
+                publisher._tag_directory()
+
+            # Staged publishes only get their version once in place.
+            requests = [
+                self._update_request(publisher, updates_)
+                for publisher, updates_, staged_ in zip(self.publishers, updates, staged)
+                if staged_
+            ]
+            if requests:
+                self._call_shotgun('update',
+                    [p for p, s in zip(self.publishers, staged) if s],
+                    self.sgfs.session.batch, requests,
+                )
+
+            for publisher in self.publishers:
+                publisher._finish_commit()
+
+        except:
+            self.rollback()
+            raise
+
+    def _call_shotgun(self, phase, publishers, func, *args, **kwargs):
+        # Shared requests are counted (and timed) by every publisher in them.
+        start_time = time.time()
+        try:
+            if phase in _idempotent_phases:
+                return governor.call_idempotent(func, *args, **kwargs)
+            else:
+                return governor.call(func, *args, **kwargs)
+        finally:
+            elapsed = time.time() - start_time
+            for publisher in publishers:
+                publisher._record_timing(phase, elapsed, 1)
+
+    def _update_request(self, publisher, updates):
+        return {
+            'request_type': 'update',
+            'entity_type': 'PublishEvent',
+            'entity_id': publisher.entity['id'],
+            'data': updates,
+        }
+
+    def rollback(self):
+        try:
+            rollback_many(self.publishers)
+        except Exception:
+            log.exception('error while rolling back %d publishes' % len(self.publishers))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        if exc_info and exc_info[0] is not None:
+            self.rollback()
+            return
+        self.commit()
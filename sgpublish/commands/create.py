@@ -3,7 +3,8 @@ from __future__ import absolute_import
 import argparse
 import os
 
-from ..publisher import Publisher
+from ..publisher import Publisher, DEFAULT_COPY_WORKERS
+from ..throttle import DEFAULT_IO_CLASS, IO_CLASSES
 from ..utils import basename
 from .utils import add_publisher_arguments, extract_publisher_kwargs
 
@@ -19,6 +20,12 @@ def main(argv=None):
     input_group.add_argument('-C', '--relative-to', metavar='PATH',
         help='absolute paths are interpreted as relative to this one; defaults to the current working directory',
         default=os.getcwd())
+    input_group.add_argument('-j', '--jobs', metavar='N', type=int,
+        dest='publisher_copy_workers',
+        help='how many files to copy at once; defaults to that of the I/O class, or %d' % DEFAULT_COPY_WORKERS)
+    input_group.add_argument('--io-class', choices=sorted(IO_CLASSES),
+        dest='publisher_io_class',
+        help='limits the bandwidth (and default --jobs) of the copy; defaults to $SGPUBLISH_IO_CLASS, or %s' % DEFAULT_IO_CLASS)
     input_group.add_argument('files', nargs='+',
         help='the files to include in the publish')
 
@@ -0,0 +1,36 @@
+from __future__ import absolute_import
+
+import argparse
+import logging
+
+from ..dedupe import ObjectStore
+from ..utils import format_bytes
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(
+        description='Remove deduplicated objects which are no longer used by any publish.',
+    )
+    parser.add_argument('-n', '--dry-run', action='store_true',
+        help='only report what would be removed')
+    parser.add_argument('-v', '--verbose', action='store_true',
+        help='list every object as it is removed')
+    parser.add_argument('stores', nargs='+', metavar='STORE',
+        help='object store directories; usually PROJECT/.sgpublish/objects')
+
+    args = parser.parse_args(argv)
+
+    if args.verbose:
+        logging.basicConfig(level=logging.DEBUG)
+
+    for root in args.stores:
+        count, size = ObjectStore(root).collect_garbage(dry_run=args.dry_run)
+        print '%s %d objects (%s) from %s' % (
+            'Would remove' if args.dry_run else 'Removed',
+            count, format_bytes(size), root,
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+"""A content-addressed store which publishes can share unchanged files through.
+
+Objects are named by the digest of their contents and hardlinked into every
+publish which uses them, so the filesystem's link count doubles as the
+reference count: an object with a single link is no longer used by any publish
+and may be collected by :meth:`ObjectStore.collect_garbage`.
+
+"""
+
+import errno
+import logging
+import os
+import shutil
+import stat
+import tempfile
+import time
+
+from . import utils
+from .transfer import copy_and_hash, hash_file
+
+
+log = logging.getLogger(__name__)
+
+
+#: The :mod:`hashlib` algorithm used to name objects.
+DIGEST_ALGORITHM = 'sha256'
+
+_exec_mask = stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH
+
+
+class ObjectStore(object):
+
+    """A directory of read-only files named by the digest of their contents.
+
+    :param str root: The directory to store objects in; it must be on the same
+        filesystem as the publishes for them to be linked.
+
+    """
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+
+    @classmethod
+    def for_project(cls, sgfs, project):
+        """Get the store under the given project's root, or ``None`` if the
+        project does not exist on disk."""
+        project_root = sgfs.path_for_entity(project)
+        if not project_root:
+            return
+        return cls(os.path.join(project_root, '.sgpublish', 'objects'))
+
+    def path_for_digest(self, digest, executable=False):
+        # Files which only differ in their exec bits must not share an inode.
+        return os.path.join(self.root, digest[:2], digest[2:] + ('.x' if executable else ''))
+
+    def add(self, src_path, digest=None, throttle=None):
+        """Place a file into the store (unless it is already there).
+
+        :param throttle: A :class:`~sgpublish.throttle.Throttle` for the copy.
+        :returns: ``(digest, object_path)``
+
+        """
+
+        digest = digest or hash_file(src_path, DIGEST_ALGORITHM)
+        executable = bool(os.stat(src_path).st_mode & _exec_mask)
+        obj_path = self.path_for_digest(digest, executable)
+
+        if os.path.exists(obj_path):
+            return digest, obj_path
+
+        obj_dir = os.path.dirname(obj_path)
+        utils.makedirs(obj_dir)
+
+        # Copy it in under a temporary name, and then link it into place so
+        # that concurrent publishes of the same file can't clobber each other.
+        fd, tmp_path = tempfile.mkstemp(dir=obj_dir, prefix='.tmp.')
+        os.close(fd)
+        try:
+            if throttle is not None:
+                copy_and_hash(src_path, tmp_path, None, throttle=throttle)
+            else:
+                shutil.copyfile(src_path, tmp_path)
+            os.chmod(tmp_path, 0o555 if executable else 0o444)
+            try:
+                os.link(tmp_path, obj_path)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+        finally:
+            os.unlink(tmp_path)
+
+        return digest, obj_path
+
+    def link(self, src_path, dst_path, digest=None, throttle=None):
+        """Hardlink ``dst_path`` to the stored copy of ``src_path``.
+
+        :returns: The digest of the file.
+
+        """
+        digest, obj_path = self.add(src_path, digest, throttle)
+        try:
+            os.link(obj_path, dst_path)
+        except OSError as e:
+            # The garbage collector may have removed it between the two calls.
+            if e.errno != errno.ENOENT:
+                raise
+            digest, obj_path = self.add(src_path, digest, throttle)
+            os.link(obj_path, dst_path)
+        return digest
+
+    def iter_objects(self):
+        """Yield ``(path, stat)`` for every object in the store."""
+        for dir_path, dir_names, file_names in os.walk(self.root):
+            for file_name in file_names:
+                path = os.path.join(dir_path, file_name)
+                try:
+                    yield path, os.lstat(path)
+                except OSError as e:
+                    if e.errno != errno.ENOENT:
+                        raise
+
+    def collect_garbage(self, dry_run=False, tmp_max_age=24 * 3600):
+        """Remove objects which are not linked into any publish.
+
+        Abandoned temporary files older than ``tmp_max_age`` seconds are also
+        removed.
+
+        :returns: ``(count, bytes)`` of what was (or would be) removed.
+
+        """
+
+        count = size = 0
+        now = time.time()
+
+        for path, st in self.iter_objects():
+
+            if os.path.basename(path).startswith('.tmp.'):
+                if now - st.st_mtime < tmp_max_age:
+                    continue
+            elif st.st_nlink > 1:
+                continue
+
+            log.debug('%s %s' % ('would remove' if dry_run else 'removing', path))
+            count += 1
+            size += st.st_size
+            if not dry_run:
+                try:
+                    os.unlink(path)
+                except OSError as e:
+                    if e.errno != errno.ENOENT:
+                        raise
+
+        return count, size
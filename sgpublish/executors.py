@@ -0,0 +1,159 @@
+"""Thread pools shared by all of sgpublish.
+
+Rather than every :class:`.Publisher` (and every promotion to a Version)
+spinning up its own threads, work is submitted to a few named, lazily created,
+bounded pools which live for the life of the process:
+
+``"shotgun"``
+    Concurrent Shotgun requests. How many actually run at once is limited by
+    the :mod:`.governor`, so this only needs to be at least its maximum.
+
+``"io"``
+    Copying files into publishes.
+
+``"commit"``
+    Background commits from :meth:`.Publisher.commit_async`.
+
+The size of each may be set via :func:`set_max_workers` (before or after it is
+first used), or the ``SGPUBLISH_{NAME}_WORKERS`` environment variable.
+
+"""
+
+import atexit
+import logging
+import os
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+
+log = logging.getLogger(__name__)
+
+
+#: The default size of each pool.
+DEFAULT_MAX_WORKERS = {
+    'shotgun': 16,
+    'io': 16,
+    'commit': 2,
+}
+
+
+class ExecutorService(object):
+
+    """A lazily created thread pool which counts what it is doing.
+
+    :param str name: For logging.
+    :param int max_workers: How many threads to run at once.
+
+    """
+
+    def __init__(self, name, max_workers):
+        self.name = name
+        self.max_workers = max_workers
+        self._executor = None
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._active = 0
+        self._completed = 0
+
+    @property
+    def queued(self):
+        """How many tasks are waiting for a thread."""
+        return self._queued
+
+    @property
+    def active(self):
+        """How many tasks are running right now."""
+        return self._active
+
+    @property
+    def completed(self):
+        """How many tasks have run to completion (successful or not)."""
+        return self._completed
+
+    def stats(self):
+        return {
+            'max_workers': self.max_workers,
+            'queued': self._queued,
+            'active': self._active,
+            'completed': self._completed,
+        }
+
+    def submit(self, func, *args, **kwargs):
+        """Schedule ``func(*args, **kwargs)``, returning a :class:`~concurrent.futures.Future`."""
+        with self._lock:
+            if self._executor is None:
+                log.debug('starting %s pool with %d workers' % (self.name, self.max_workers))
+                self._executor = ThreadPoolExecutor(self.max_workers)
+            executor = self._executor
+            self._queued += 1
+        future = executor.submit(self._run, func, args, kwargs)
+        future.add_done_callback(self._on_done)
+        return future
+
+    def _run(self, func, args, kwargs):
+        with self._lock:
+            self._queued -= 1
+            self._active += 1
+        try:
+            return func(*args, **kwargs)
+        finally:
+            with self._lock:
+                self._active -= 1
+                self._completed += 1
+
+    def _on_done(self, future):
+        # Cancelled tasks never ran, so were never taken out of the queue.
+        if future.cancelled():
+            with self._lock:
+                self._queued -= 1
+
+    def resize(self, max_workers):
+        """Change the number of threads; work already submitted is unaffected."""
+        with self._lock:
+            self.max_workers = max_workers
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+
+_services = {}
+_services_lock = threading.Lock()
+
+
+def get(name):
+    """Get the named :class:`ExecutorService`, creating it if required."""
+    try:
+        return _services[name]
+    except KeyError:
+        pass
+    with _services_lock:
+        service = _services.get(name)
+        if service is None:
+            max_workers = os.environ.get('SGPUBLISH_%s_WORKERS' % name.upper())
+            max_workers = int(max_workers) if max_workers else DEFAULT_MAX_WORKERS.get(name, 4)
+            service = _services[name] = ExecutorService(name, max_workers)
+        return service
+
+
+def set_max_workers(name, max_workers):
+    """Set the size of the named pool."""
+    get(name).resize(max_workers)
+
+
+def stats():
+    """Get counters for every pool; ``{name: {'queued': int, ...}}``."""
+    return dict((name, service.stats()) for name, service in _services.items())
+
+
+@atexit.register
+def shutdown(wait=True):
+    """Shutdown every pool; they will be recreated if used again."""
+    for service in list(_services.values()):
+        service.shutdown(wait=wait)
@@ -49,13 +49,17 @@ class Exporter(object):
         """
         pass
     
-    def publish(self, link=None, name=None, export_kwargs=None, **publisher_kwargs):
+    def publish(self, link=None, name=None, export_kwargs=None, async_commit=False, **publisher_kwargs):
         """Trigger a publish.
         
         This method only deals with setting up the publisher, and uses
         :meth:`export_publish` to do the work.
         
         :param export_kwargs: Passed to :meth:`export_publish`.
+        :param bool async_commit: Return as soon as the export is done, and
+            commit the publish in the background via
+            :meth:`.Publisher.commit_async`; see its
+            :attr:`~.Publisher.commit_future`.
         :returns: The publisher used.
         
         """
@@ -65,7 +69,8 @@ class Exporter(object):
             raise ValueError('cannot publish without type')
 
         publisher_kwargs.pop('type', None)
-        with Publisher(link=link, type=type_, name=name, **publisher_kwargs) as publisher:
+        publisher = Publisher(link=link, type=type_, name=name, **publisher_kwargs)
+        try:
             
             # Record the ID before the export so that it is included.
             self.record_publish_id(publisher.id)
@@ -76,7 +81,16 @@ class Exporter(object):
             # Completely overridable by children (without calling super).
             self.export_publish(publisher, **export_kwargs)
             
-            return publisher
+        except:
+            publisher.rollback()
+            raise
+
+        if async_commit:
+            publisher.commit_async()
+        else:
+            publisher.commit()
+            
+        return publisher
     
     def before_export_publish(self, publisher, **kwargs):
         pass
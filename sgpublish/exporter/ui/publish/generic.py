@@ -450,13 +450,18 @@ class Widget(Q.QWidget):
         return True
         
     def export(self, **kwargs):
-        self._export(kwargs)
-        return
+        # The publisher (if any) is returned so that callers may watch
+        # background commits.
+        return self._export(kwargs)
         with ticket_ui_context(pass_through=PublishSafetyError):
             return self._export(kwargs)
     
     def _export(self, kwargs):
     
+        # Not for the exporter itself.
+        async_commit = kwargs.pop('async_commit', False)
+        progress_callback = kwargs.pop('progress_callback', None)
+
         if not self.safety_check(**kwargs):
             raise PublishSafetyError()
         
@@ -489,6 +494,8 @@ class Widget(Q.QWidget):
             movie_path=self.movie_path(),
             review_version_fields=review_version_fields,
             export_kwargs=kwargs,
+            async_commit=async_commit,
+            progress_callback=progress_callback,
         )
         
         # Create the timelog.
@@ -0,0 +1,180 @@
+"""Adaptive limiting of concurrent Shotgun requests.
+
+Rather than every module guessing how many requests Shotgun can take at once
+(too many was "causing collisions in Shotgun's servers"), all of sgpublish's
+requests go through one :class:`Governor`. It finds the limit itself: it
+allows one more concurrent request for every window of successes, and halves
+the limit upon faults, transient errors, or requests which are much slower
+than usual for their kind (e.g. ``find``). Requests whose time depends upon
+how much they carry (batches and uploads) never count as slow.
+
+Idempotent requests (reads, and updates to fixed values) are retried with
+jittered backoff upon transient (i.e. network) errors. Creates are not, as a
+request which timed out may still have been applied.
+
+The maximum may be set via the ``SGPUBLISH_SHOTGUN_CONCURRENCY`` environment
+variable.
+
+"""
+
+import httplib
+import logging
+import os
+import random
+import socket
+import threading
+import time
+
+import shotgun_api3.shotgun as shotgun_api3
+from shotgun_api3.shotgun import Fault as ShotgunFault
+
+
+log = logging.getLogger(__name__)
+
+
+# Network errors that are likely to succeed if tried again. Not IOError,
+# since that is also raised for local files (e.g. a missing thumbnail).
+_transient_errors = (socket.error, httplib.HTTPException)
+if hasattr(shotgun_api3, 'ProtocolError'):
+    _transient_errors += (shotgun_api3.ProtocolError, )
+
+# Requests whose latency says more about their size than Shotgun's load.
+_size_dependent_kinds = frozenset((
+    'batch',
+    'share_thumbnail',
+    'upload',
+    'upload_filmstrip_thumbnail',
+    'upload_thumbnail',
+))
+
+
+class Governor(object):
+
+    """An additive-increase/multiplicative-decrease concurrency limit.
+
+    :param int initial: The starting limit.
+    :param int minimum: The limit never drops below this.
+    :param int maximum: The limit never grows above this.
+    :param int retries: How many times idempotent requests are retried.
+    :param float spike_factor: Requests slower than this multiple of the
+        moving average latency of their kind count as a sign of overload.
+    :param float spike_floor: Requests faster than this many seconds never
+        count as a sign of overload.
+
+    """
+
+    def __init__(self, initial=4, minimum=1, maximum=16, retries=3, spike_factor=4.0, spike_floor=1.0):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.retries = retries
+        self.spike_factor = spike_factor
+        self.spike_floor = spike_floor
+        self._limit = float(max(minimum, min(initial, maximum)))
+        self._active = 0
+        self._latencies = {} # {kind: moving average}
+        self._cond = threading.Condition()
+        self._counts = {'successes': 0, 'failures': 0, 'retries': 0, 'backoffs': 0}
+
+    @property
+    def limit(self):
+        """How many requests may currently run at once."""
+        return int(self._limit)
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._counts)
+            stats.update(limit=self.limit, active=self._active, latencies=dict(self._latencies))
+            return stats
+
+    def call(self, func, *args, **kwargs):
+        """Call ``func(*args, **kwargs)`` once a slot is available."""
+        return self._call(False, func, args, kwargs)
+
+    def call_idempotent(self, func, *args, **kwargs):
+        """Like :meth:`call`, but retries upon transient errors."""
+        return self._call(True, func, args, kwargs)
+
+    def _call(self, idempotent, func, args, kwargs):
+
+        kind = getattr(func, '__name__', None)
+        attempt = 0
+        while True:
+
+            with self._cond:
+                while self._active >= int(self._limit):
+                    self._cond.wait()
+                self._active += 1
+
+            start_time = time.time()
+            try:
+                result = func(*args, **kwargs)
+            except (ShotgunFault, ) + _transient_errors as e:
+                self._release(kind, time.time() - start_time, failed=True)
+                attempt += 1
+                if not idempotent or attempt > self.retries or not isinstance(e, _transient_errors):
+                    raise
+                delay = 0.5 * 2 ** (attempt - 1) * random.uniform(0.5, 1.5)
+                log.warning('retrying Shotgun request in %.2fs after %s: %s' % (delay, e.__class__.__name__, e))
+                with self._cond:
+                    self._counts['retries'] += 1
+                time.sleep(delay)
+            except:
+                # Not Shotgun's fault.
+                self._release(kind, time.time() - start_time)
+                raise
+            else:
+                self._release(kind, time.time() - start_time, succeeded=True)
+                return result
+
+    def _release(self, kind, elapsed, succeeded=False, failed=False):
+        with self._cond:
+
+            self._active -= 1
+
+            spiked = False
+            if succeeded:
+                self._counts['successes'] += 1
+                latency = self._latencies.get(kind)
+                if latency is None:
+                    self._latencies[kind] = elapsed
+                else:
+                    if kind not in _size_dependent_kinds:
+                        spiked = elapsed > max(self.spike_floor, self.spike_factor * latency)
+                    self._latencies[kind] = 0.8 * latency + 0.2 * elapsed
+            elif failed:
+                self._counts['failures'] += 1
+
+            if failed or spiked:
+                self._counts['backoffs'] += 1
+                self._limit = max(self.minimum, self._limit / 2)
+                log.debug('Shotgun concurrency backed off to %d' % self.limit)
+            elif succeeded:
+                # One more slot for every full window of successes.
+                self._limit = min(self.maximum, self._limit + 1 / self._limit)
+
+            self._cond.notify_all()
+
+
+_governor = None
+_governor_lock = threading.Lock()
+
+
+def get():
+    """Get the :class:`Governor` shared by all of sgpublish."""
+    global _governor
+    if _governor is None:
+        with _governor_lock:
+            if _governor is None:
+                maximum = os.environ.get('SGPUBLISH_SHOTGUN_CONCURRENCY')
+                _governor = Governor(maximum=int(maximum) if maximum else 16)
+    return _governor
+
+
+def call(func, *args, **kwargs):
+    """Call ``func`` via the shared governor; see :meth:`Governor.call`."""
+    return get().call(func, *args, **kwargs)
+
+
+def call_idempotent(func, *args, **kwargs):
+    """Call ``func`` via the shared governor; see :meth:`Governor.call_idempotent`."""
+    return get().call_idempotent(func, *args, **kwargs)
@@ -0,0 +1,140 @@
+"""A record of a publish's progress, so that an interrupted commit can resume.
+
+The journal lives within the publish directory. The first line is the plan of
+the commit (everything required to rebuild the :class:`.Publisher`), and
+every following line records a file which was completely copied. Each line is
+written and synced on its own, so a journal is valid up to the last complete
+line no matter when the process died.
+
+See :meth:`.Publisher.resume`.
+
+"""
+
+import errno
+import json
+import os
+import threading
+
+
+#: The name of the journal within a publish directory.
+JOURNAL_NAME = '.sgpublish.journal'
+
+
+class Journal(object):
+
+    """The plan of a publish's commit, and the files which have been completed.
+
+    :param str directory: The directory the publish is being written into.
+
+    """
+
+    def __init__(self, directory, plan=None, completed=None, _valid_size=None):
+        self.directory = os.path.abspath(directory)
+        self.plan = plan
+        self.completed = dict(completed or {})
+        self._lock = threading.Lock()
+        self._fh = None
+        # How much of the file was valid when loaded, so a partial line
+        # isn't left in front of what we append.
+        self._valid_size = _valid_size
+
+    @property
+    def path(self):
+        return os.path.join(self.directory, JOURNAL_NAME)
+
+    @classmethod
+    def load(cls, directory):
+        """Load the journal in the given directory, or ``None``."""
+
+        try:
+            fh = open(os.path.join(directory, JOURNAL_NAME))
+        except IOError as e:
+            if e.errno == errno.ENOENT:
+                return
+            raise
+
+        plan = None
+        completed = {}
+        valid_size = 0
+        with fh:
+            for line in fh:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break # Partially written before a crash.
+                if not line.endswith('\n'):
+                    break
+                valid_size += len(line)
+                if plan is None:
+                    plan = record
+                else:
+                    completed[record['path']] = record
+
+        if plan is None:
+            return
+        return cls(directory, plan, completed, valid_size)
+
+    def _write(self, record, mode='a'):
+        with self._lock:
+            if self._fh is None or mode == 'w':
+                self.close()
+                self._fh = open(self.path, mode)
+                if mode == 'a' and self._valid_size is not None:
+                    self._fh.truncate(self._valid_size)
+                self._valid_size = None
+            self._fh.write(json.dumps(record, sort_keys=True) + '\n')
+            self._fh.flush()
+            os.fsync(self._fh.fileno())
+
+    def start(self, plan):
+        """Begin a new journal with the given plan."""
+        self.plan = plan
+        self.completed = {}
+        self._write(plan, 'w')
+
+    def record(self, path, method, digest=None):
+        """Record that a file has been completely written."""
+        try:
+            st = os.stat(path)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            st = None # A placeholder.
+        record = {
+            'path': path,
+            'method': method,
+            'digest': digest,
+            'size': st.st_size if st else None,
+            'mtime': st.st_mtime if st else None,
+        }
+        self.completed[path] = record
+        self._write(record)
+
+    def is_complete(self, path):
+        """Was the given file completely written, and is it unchanged since?"""
+        record = self.completed.get(path)
+        if record is None:
+            return False
+        if record['size'] is None:
+            return True
+        try:
+            st = os.stat(path)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return False
+        return st.st_size == record['size'] and st.st_mtime == record['mtime']
+
+    def close(self):
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+
+    def remove(self):
+        """Close and delete the journal."""
+        self.close()
+        try:
+            os.unlink(self.path)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
@@ -0,0 +1,152 @@
+"""Checksum manifests of the files within a publish.
+
+:class:`.Publisher` writes a manifest next to the SGFS tag, with the size of
+every file in the publish, and the checksum of every file it copied; those are
+computed from the same buffers as they are written, so the files are not read
+again. Files written in place (e.g. by exporters), moved, or linked are only
+recorded by size (with a ``None`` digest), since hashing them would mean
+reading them back in full. The :mod:`transfer <sgpublish.transfer>` method
+which got each file into the publish is also recorded. Consumers can then cheaply validate that the files they are about to use
+are intact::
+
+    >>> manifest = Manifest.find(path)
+    >>> if manifest and manifest.verify([path]):
+    ...     raise ValueError('publish is corrupt')
+
+"""
+
+import errno
+import json
+import os
+
+from .transfer import hash_file
+
+
+#: The name of the manifest within a publish directory.
+MANIFEST_NAME = '.sgpublish.manifest.json'
+
+#: The :mod:`hashlib` algorithm used for new manifests.
+DEFAULT_ALGORITHM = 'sha256'
+
+
+class Manifest(object):
+
+    """The sizes and checksums of the files in a publish directory.
+
+    :param str directory: The root of the publish.
+    :param str algorithm: The :mod:`hashlib` algorithm of the checksums.
+    :param dict files: ``{rel_path: {'size': int, 'digest': str_or_None,
+        'method': str_or_None}}``
+
+    """
+
+    def __init__(self, directory, algorithm=DEFAULT_ALGORITHM, files=None):
+        self.directory = os.path.abspath(directory)
+        self.algorithm = algorithm
+        self.files = dict(files or {})
+
+    @property
+    def path(self):
+        return os.path.join(self.directory, MANIFEST_NAME)
+
+    @classmethod
+    def load(cls, directory):
+        """Load the manifest in the given publish directory, or ``None``."""
+        try:
+            with open(os.path.join(directory, MANIFEST_NAME)) as fh:
+                data = json.load(fh)
+        except IOError as e:
+            if e.errno == errno.ENOENT:
+                return
+            raise
+        return cls(directory, data['algorithm'], data['files'])
+
+    @classmethod
+    def find(cls, path):
+        """Load the manifest of the publish which contains the given path, or ``None``."""
+        directory = os.path.abspath(path)
+        if not os.path.isdir(directory):
+            directory = os.path.dirname(directory)
+        while True:
+            if os.path.exists(os.path.join(directory, MANIFEST_NAME)):
+                return cls.load(directory)
+            parent = os.path.dirname(directory)
+            if parent == directory:
+                return
+            directory = parent
+
+    def save(self):
+        with open(self.path, 'w') as fh:
+            json.dump({
+                'algorithm': self.algorithm,
+                'files': self.files,
+            }, fh, indent=4, sort_keys=True)
+
+    def add(self, path, size=None, digest=None, compute_digest=True, method=None):
+        """Record a file, measuring anything that is not provided.
+
+        :param bool compute_digest: Hash the file if no ``digest`` is given;
+            otherwise only its size is recorded.
+        :param str method: How the file got into the publish, if it was
+            transferred rather than written in place.
+
+        """
+        path = os.path.abspath(path)
+        if not digest and compute_digest:
+            digest = hash_file(path, self.algorithm)
+        self.files[os.path.relpath(path, self.directory)] = {
+            'size': os.path.getsize(path) if size is None else size,
+            'digest': digest or None,
+            'method': method,
+        }
+
+    def verify(self, paths=None, deep=False):
+        """Check files against the manifest.
+
+        By default only the existence and size of files are checked, which
+        does not read them.
+
+        :param paths: The files to check; defaults to all in the manifest.
+            Directories will check every file within them.
+        :param bool deep: Also compare checksums, which reads every file
+            which has one.
+        :returns: A list of ``(path, problem)`` tuples; empty if all is well.
+
+        """
+
+        if paths is None:
+            rel_paths = sorted(self.files)
+        else:
+            rel_paths = []
+            for path in paths:
+                rel_path = os.path.relpath(os.path.abspath(path), self.directory)
+                if rel_path == os.curdir:
+                    rel_paths.extend(sorted(self.files))
+                    continue
+                prefix = rel_path + os.sep
+                contained = sorted(x for x in self.files if x.startswith(prefix))
+                rel_paths.extend(contained or [rel_path])
+
+        problems = []
+        for rel_path in rel_paths:
+
+            path = os.path.join(self.directory, rel_path)
+            entry = self.files.get(rel_path)
+            if entry is None:
+                problems.append((path, 'not in manifest'))
+                continue
+
+            try:
+                size = os.path.getsize(path)
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+                problems.append((path, 'missing'))
+                continue
+
+            if size != entry['size']:
+                problems.append((path, 'size is %d; expected %d' % (size, entry['size'])))
+            elif deep and entry['digest'] and hash_file(path, self.algorithm) != entry['digest']:
+                problems.append((path, '%s mismatch' % self.algorithm))
+
+        return problems
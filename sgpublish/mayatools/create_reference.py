@@ -10,6 +10,9 @@ from sgfs.ui.picker import presets as picker_presets
 from sgfs.ui.picker.nodes.base import Node as BaseNode
 from sgfs import SGFS
 
+from sgpublish import tagcache
+from sgpublish import uiutils as ui_utils
+
 
 class ScenePickerNode(BaseNode):
 
@@ -88,26 +91,24 @@ class Preview(Q.Widgets.Widget):
         self._description_label.setText(str(desc))
         
         sgfs = SGFS(session=entity.session)
-        path = sgfs.path_for_entity(entity)
-        tags = sgfs.get_directory_entity_tags(path)
-        tags = [t for t in tags if t['entity'] is entity]
-        tag = tags[0]
+        path, tag = tagcache.get_entity_tag(sgfs, entity)
+        tag = tag or {}
 
         maya_data = tag.get('maya', {})
         time_range = '%s - %s' % (maya_data.get('min_time'), maya_data.get('max_time'))
         self._timeRangeLabel.setText(time_range)
         
         if entity not in self._pixmaps:
-            thumbnail_path = tag.get('sgpublish', {}).get('thumbnail') if tags else None
-            thumbnail_path = thumbnail_path or os.path.join(path, '.sgfs.thumbnail.jpg')
-            if os.path.exists(thumbnail_path):
-                pixmap = Q.Pixmap(thumbnail_path)
-            else:
-                path = os.path.abspath(os.path.join(
+            # Prefer the small thumbnail, since it is much quicker to decode.
+            meta = tag.get('sgpublish', {})
+            thumbnail_path = meta.get('thumbnail_small') or meta.get('thumbnail')
+            thumbnail_path = os.path.join(path, thumbnail_path or '.sgfs.thumbnail.jpg')
+            pixmap = ui_utils.thumbnail(thumbnail_path, 165)
+            if pixmap is None:
+                pixmap = ui_utils.thumbnail(os.path.abspath(os.path.join(
                     __file__, '..', '..', '..', '..', 'art', 'no-thumbnail.png'
-                ))
-                pixmap = Q.Pixmap(path)
-            self._pixmaps[entity] = pixmap.scaledToWidth(165, Q.SmoothTransformation)
+                )), 165)
+            self._pixmaps[entity] = pixmap
         
         self._thumbnail.setPixmap(self._pixmaps[entity])
         self._thumbnail.setFixedSize(self._pixmaps[entity].size())
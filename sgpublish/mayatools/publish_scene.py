@@ -18,6 +18,7 @@ from concurrent.futures import ThreadPoolExecutor
 from uitools.qt import Q
 
 from maya import cmds
+import maya.utils
 
 from sgfs import SGFS
 
@@ -133,9 +134,13 @@ class Dialog(Q.Widgets.Dialog):
     def _on_submit(self, *args):
         
         # DO IT.
-        # This runs the safety check.
+        # This runs the safety check. The files are copied and Shotgun is
+        # updated in the background, so we can get out of the artist's way.
         try:
-            publisher = self._publish_widget.export()
+            publisher = self._publish_widget.export(
+                async_commit=True,
+                progress_callback=_on_commit_progress,
+            )
         except PublishSafetyError:
             return
 
@@ -143,13 +148,42 @@ class Dialog(Q.Widgets.Dialog):
         if not publisher:
             return
         
+        publisher.commit_future.add_done_callback(functools.partial(_on_commit_done, publisher))
+        
+        self.close()
+
+
+def _on_commit_progress(publisher, phase, done, total):
+    # Called from the commit thread, but Maya must only be used from the main one.
+    if phase == 'copy':
+        message = 'Publishing "%s": copied %d of %d files' % (publisher.name, done, total)
+    else:
+        message = 'Publishing "%s": %s' % (publisher.name, phase)
+    maya.utils.executeDeferred(sys.stdout.write, message + '\n')
+
+
+def _on_commit_done(publisher, future):
+    maya.utils.executeDeferred(_announce_commit, publisher, future)
+
+
+def _announce_commit(publisher, future):
+
+    error = future.exception()
+    if error is None:
         ui_utils.announce_publish_success(
             publisher,
             message="Version {publisher.version} of \"{publisher.name}\" has"
                 " been published. Remember to version up!"
         )
-        
-        self.close()
+        return
+
+    # The publisher has already rolled itself back.
+    Q.MessageBox.critical(None,
+        'Publish Failed',
+        'Version %d of "%s" could not be published, and has been rolled back:\n\n%s' % (
+            publisher.version, publisher.name, error,
+        ),
+    )
 
 
 
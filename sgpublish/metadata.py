@@ -0,0 +1,171 @@
+"""Keeping ``sg_metadata`` small.
+
+Exporters may put a lot into :attr:`.Publisher.metadata` (e.g. every
+``fileInfo`` of a Maya scene), which slows down the Shotgun update and every
+later fetch of the publish. Metadata which encodes to more than
+:data:`DEFAULT_MAX_SIZE` bytes is written into a gzipped sidecar within the
+publish, and Shotgun only gets a summary (the small values near the top of
+the metadata) and a pointer to the sidecar::
+
+    >>> meta = metadata.load(publish['sg_metadata'])
+    >>> meta.summary['maya']['version'] # Never reads the sidecar.
+    2016
+    >>> meta['maya']['file_info'] # Reads the sidecar.
+    {...}
+
+"""
+
+import collections
+import gzip
+import json
+import os
+
+
+#: The name of the sidecar within a publish directory.
+SIDECAR_NAME = '.sgpublish.metadata.json.gz'
+
+#: Metadata which encodes larger than this many bytes is spilled.
+DEFAULT_MAX_SIZE = 16 * 1024
+
+# How deep into the metadata the summary goes, and the largest string in it.
+_summary_depth = 2
+_summary_max_string = 256
+
+
+def _dumps(value):
+    return json.dumps(value, sort_keys=True, separators=(',', ':'))
+
+
+def summarize(value, depth=_summary_depth, max_size=None):
+    """Keep the scalars (and short strings) of the top levels of a dict.
+
+    Smaller values are kept first, and no more are added once the summary
+    would encode to more than ``max_size`` bytes.
+
+    """
+
+    summary = {}
+    size = 2 # The braces.
+
+    # Smallest first, so that a few large values don't crowd out the rest.
+    children = sorted(value.iteritems(), key=lambda item: (len(_dumps(item[1])), item[0]))
+
+    for key, child in children:
+
+        key_size = len(_dumps(key)) + 1 + (1 if summary else 0) # Colon and comma.
+
+        if isinstance(child, dict):
+            if depth <= 1:
+                continue
+            child_max_size = None if max_size is None else max_size - size - key_size
+            if child_max_size is not None and child_max_size < 2:
+                continue
+            child = summarize(child, depth - 1, child_max_size)
+        elif isinstance(child, basestring):
+            if len(child) > _summary_max_string:
+                continue
+        elif not (child is None or isinstance(child, (bool, int, long, float))):
+            continue
+
+        entry_size = key_size + len(_dumps(child))
+        if max_size is not None and size + entry_size > max_size:
+            continue
+
+        summary[key] = child
+        size += entry_size
+
+    return summary
+
+
+def encode(metadata, directory, final_directory=None, max_size=DEFAULT_MAX_SIZE):
+    """Encode metadata for ``sg_metadata``, spilling it to a sidecar if large.
+
+    :param dict metadata: What to encode.
+    :param str directory: Where to write the sidecar.
+    :param str final_directory: Where the sidecar will end up, if the
+        directory is going to be moved (e.g. staged publishes).
+    :param int max_size: The largest encoding to keep in Shotgun; ``None``
+        never spills. Spilled metadata is only larger than this if the
+        pointer to the sidecar alone is.
+    :returns: The JSON string for Shotgun.
+
+    """
+
+    encoded = _dumps(metadata)
+    if max_size is None or len(encoded) <= max_size:
+        return encoded
+
+    path = os.path.join(directory, SIDECAR_NAME)
+    if os.path.exists(path):
+        os.unlink(path) # It may be locked from an earlier attempt.
+    fh = gzip.open(path, 'wb')
+    try:
+        fh.write(encoded)
+    finally:
+        fh.close()
+
+    pointer = {
+        '__sidecar__': os.path.join(final_directory or directory, SIDECAR_NAME),
+        'size': len(encoded),
+        'summary': {},
+    }
+
+    # The summary may only use what the pointer leaves of max_size; if that
+    # is nothing, Shotgun just gets the pointer.
+    summary_max_size = max_size - len(_dumps(pointer)) + 2
+    if summary_max_size > 2:
+        pointer['summary'] = summarize(metadata, max_size=summary_max_size)
+
+    return _dumps(pointer)
+
+
+def load(encoded):
+    """Decode ``sg_metadata``.
+
+    :returns: A :class:`LazyMetadata` if it was spilled to a sidecar,
+        otherwise a ``dict``.
+
+    """
+    if not encoded:
+        return {}
+    value = json.loads(encoded)
+    if isinstance(value, dict) and '__sidecar__' in value:
+        return LazyMetadata(value['__sidecar__'], value.get('summary'))
+    return value
+
+
+class LazyMetadata(collections.Mapping):
+
+    """Metadata in a sidecar, which is only read when it is first accessed.
+
+    :param str path: The sidecar.
+    :param dict summary: What was kept in Shotgun.
+
+    """
+
+    def __init__(self, path, summary=None):
+        self.path = path
+        self.summary = summary or {}
+        self._full = None
+
+    @property
+    def full(self):
+        if self._full is None:
+            fh = gzip.open(self.path, 'rb')
+            try:
+                self._full = json.loads(fh.read())
+            finally:
+                fh.close()
+        return self._full
+
+    def __getitem__(self, key):
+        return self.full[key]
+
+    def __iter__(self):
+        return iter(self.full)
+
+    def __len__(self):
+        return len(self.full)
+
+    def __repr__(self):
+        return '<LazyMetadata %s%s>' % (self.path, '' if self._full is None else ' (loaded)')
@@ -1,19 +1,27 @@
-from subprocess import check_call
+import contextlib
 import datetime
 import errno
 import itertools
-import json
 import logging
 import os
-import shutil
 import re
-
-import concurrent.futures
+import threading
+import time
 
 from sgfs import SGFS
 from sgsession import Session, Entity
 from shotgun_api3.shotgun import Fault as ShotgunFault
 
+from . import dedupe
+from . import executors
+from . import governor
+from . import journal
+from . import manifest
+from . import metadata
+from . import tagcache
+from . import throttle
+from . import thumbnails
+from . import transfer
 from . import utils
 from . import versions
 
@@ -33,6 +41,214 @@ _kwarg_to_field = {
 }
 
 
+#: How many files are copied into a publish at once by default.
+DEFAULT_COPY_WORKERS = 4
+
+# Shotgun requests of these phases may safely be retried; creates may not.
+_idempotent_phases = frozenset((
+    'check_link',
+    'check_tags',
+    'fetch_core',
+    'fetch_template',
+    'guess_user',
+    'rollback',
+    'update',
+    'version_lookup',
+))
+
+
+#: Callables which are passed every :class:`Publisher` once it has committed,
+#: e.g. to send its :attr:`~Publisher.timings` and :attr:`~Publisher.counters`
+#: to a metrics system. Exceptions they raise are logged and ignored.
+timing_handlers = []
+
+
+# The latest committed PublishEvent of each stream, as published by this
+# process; {(link_type, link_id, type, code): entity}
+_stream_heads = {}
+
+
+def _bytes_to_write(src_path, dst_dev, method):
+    """How many bytes a transfer will write; an upper bound for ``"auto"``."""
+    if method in ('placeholder', 'hardlink'):
+        return 0
+    if method == 'move' and os.stat(src_path).st_dev == dst_dev:
+        return 0
+    return utils.get_size(src_path)
+
+
+def _existing_parent(path):
+    while not os.path.exists(path):
+        parent = os.path.dirname(path)
+        if parent == path:
+            break
+        path = parent
+    return path
+
+
+def preflight(publishers):
+    """Measure the queued files of several publishers, and check for space.
+
+    Sources are stat-ed in parallel by the shared ``"io"`` pool, and each
+    publisher's :attr:`~Publisher.estimated_bytes` is set.
+
+    :raises OSError: ``ENOSPC`` if a destination filesystem does not have
+        room for everything which will be written to it.
+    :returns: The total estimated bytes.
+
+    """
+
+    executor = executors.get('io')
+    futures = []
+    for publisher in publishers:
+        dst_dir = _existing_parent(publisher.directory)
+        dst_dev = os.stat(dst_dir).st_dev
+        for src_path, dst_path, method in publisher._files:
+            futures.append((publisher, dst_dir, dst_dev, executor.submit(_bytes_to_write, src_path, dst_dev, method)))
+
+    for publisher in publishers:
+        publisher._estimated_bytes = 0
+
+    # Group by filesystem, since several publishes may share one.
+    required = {}
+    for publisher, dst_dir, dst_dev, future in futures:
+        size = future.result()
+        publisher._estimated_bytes += size
+        total, _ = required.get(dst_dev, (0, None))
+        required[dst_dev] = (total + size, dst_dir)
+
+    for size, dst_dir in required.itervalues():
+        st = os.statvfs(dst_dir)
+        available = st.f_bavail * st.f_frsize
+        if size > available:
+            raise OSError(errno.ENOSPC, 'publish requires %s but only %s is available' % (
+                utils.format_bytes(size), utils.format_bytes(available),
+            ), dst_dir)
+
+    return sum(publisher._estimated_bytes for publisher in publishers)
+
+
+def rollback_many(publishers, discard_empty=False):
+    """Roll back several publishers at once.
+
+    Every version is reset to 0 with a single Shotgun batch request (per
+    session), while the directories are moved aside by the shared ``"io"``
+    pool. Everything is attempted, and then the first failure is re-raised.
+
+    :param bool discard_empty: Remove directories which nothing has been
+        written into (e.g. when the preflight fails), instead of moving them
+        aside.
+
+    """
+
+    publishers = list(publishers)
+    ids = [publisher._pop_id() for publisher in publishers]
+
+    io_executor = executors.get('io')
+    futures = [
+        io_executor.submit(publisher._discard_directory if discard_empty else publisher._move_aside, id_)
+        for publisher, (id_, _) in zip(publishers, ids)
+    ]
+
+    by_session = {}
+    for publisher, (id_, needs_reset) in zip(publishers, ids):
+        if needs_reset:
+            session = publisher.sgfs.session
+            by_session.setdefault(id(session), (session, []))[1].append((publisher, id_))
+
+    errors = []
+    for session, to_reset in by_session.itervalues():
+        start_time = time.time()
+        try:
+            if len(to_reset) == 1:
+                governor.call_idempotent(session.update, 'PublishEvent', to_reset[0][1], {'sg_version': 0})
+            else:
+                governor.call_idempotent(session.batch, [{
+                    'request_type': 'update',
+                    'entity_type': 'PublishEvent',
+                    'entity_id': id_,
+                    'data': {'sg_version': 0},
+                } for _, id_ in to_reset])
+        except Exception as e:
+            log.exception('error while resetting %d publish version(s)' % len(to_reset))
+            errors.append(e)
+        finally:
+            elapsed = time.time() - start_time
+            for publisher, _ in to_reset:
+                publisher._record_timing('rollback', elapsed, 1)
+
+    for future in futures:
+        if future.exception() is not None:
+            errors.append(future.exception())
+
+    if errors:
+        raise errors[0]
+
+
+def copy_files(publishers, max_workers=DEFAULT_COPY_WORKERS):
+    """Copy the queued files of several publishers through one pipeline.
+
+    Files are copied by the shared ``"io"`` pool of :mod:`sgpublish.executors`,
+    with at most ``max_workers`` at once. The first failure is re-raised once
+    everything that was started has finished, and nothing more is started
+    after a failure.
+
+    """
+
+    jobs = [(publisher, file_args) for publisher in publishers for file_args in publisher._files]
+    if not jobs:
+        return
+
+    # Create all of the directories up front so the workers don't race.
+    for dst_dir in sorted(set(os.path.dirname(file_args[1]) for _, file_args in jobs)):
+        utils.makedirs(dst_dir)
+
+    start_time = time.time()
+    total_bytes = 0
+
+    # The pool is shared with everything else, so we limit how much of it we
+    # take up ourselves.
+    executor = executors.get('io')
+    slots = threading.BoundedSemaphore(max_workers)
+    errors = []
+
+    def on_done(future):
+        if not future.cancelled() and future.exception() is not None:
+            errors.append(future.exception())
+        slots.release()
+
+    futures = []
+    for publisher, file_args in jobs:
+        slots.acquire()
+        if errors:
+            # Don't bother starting anything else.
+            slots.release()
+            break
+        future = executor.submit(publisher._timed_add_file, *file_args)
+        future.add_done_callback(on_done)
+        futures.append(future)
+
+    # Wait for everything which was started, then raise the first failure.
+    for future in futures:
+        if future.exception() is None:
+            total_bytes += future.result()
+    for future in futures:
+        future.result()
+
+    elapsed = time.time() - start_time
+    for publisher in publishers:
+        publisher._record_timing('copy', elapsed)
+    log.info('added %d files (%s) to %d publish%s in %.2fs at %s/s with %d workers' % (
+        len(jobs),
+        utils.format_bytes(total_bytes),
+        len(publishers),
+        '' if len(publishers) == 1 else 'es',
+        elapsed,
+        utils.format_bytes(total_bytes / elapsed if elapsed else 0),
+        max_workers,
+    ))
+
+
 class Publisher(object):
 
     """A publishing assistant.
@@ -80,6 +296,77 @@ class Publisher(object):
 
     :param bool defer_entities: Wait to create anything on Shotgun until later?
 
+    :param int copy_workers: How many queued files to copy at once during
+        :meth:`commit`. Defaults to that of the ``io_class``, or
+        :data:`DEFAULT_COPY_WORKERS`. They are copied by the shared ``"io"``
+        pool of :mod:`sgpublish.executors`, so this is also limited by the
+        size of that pool.
+
+    :param str io_class: ``"interactive"``, ``"farm"``, or ``"bulk"``; sets
+        the bandwidth limit and default ``copy_workers``. See
+        :mod:`sgpublish.throttle` for the defaults.
+
+    :param bandwidth: Limit this publish's copies to this many bytes per
+        second (e.g. ``50 * 1024 * 1024`` or ``"50M"``), instead of sharing
+        the limit of its ``io_class``.
+
+    :param int metadata_max_size: :attr:`metadata` which encodes larger than
+        this many bytes is written into a compressed sidecar in the publish,
+        and ``sg_metadata`` only gets a summary; see :mod:`sgpublish.metadata`.
+        ``None`` always keeps it all in Shotgun.
+
+    :param int thumbnail_max_size: The thumbnail is downscaled to fit within
+        this many pixels (see :mod:`sgpublish.thumbnails`); the small copy is
+        what is uploaded to Shotgun, and both are kept in the publish. ``0``
+        uploads the original.
+
+    :param dedupe: Copy files via a content-addressed store so that unchanged
+        files are shared between publishes. ``True`` uses the store under the
+        project's root.
+    :type dedupe: bool or :class:`~sgpublish.dedupe.ObjectStore`
+
+    :param bool staged: Place files into a hidden sibling of the publish
+        directory, which is renamed into place once everything has been copied
+        so that nobody sees a partial publish. :attr:`directory` is the staging
+        directory until then, and paths within it are translated upon commit.
+        Only applies if the ``directory`` is not supplied.
+
+    :param bool cache_version: Allocate automatic versions from the latest
+        publish this process has committed to the stream (if any) instead of
+        asking Shotgun. Only safe when this process is the only one publishing
+        to the stream, e.g. for back-to-back publishes from a farm job.
+
+    :param bool checksums: Write a :class:`~sgpublish.manifest.Manifest` of
+        every file into the publish. Copied files are hashed as they are
+        written; others are only recorded by size. Defaults to ``True``.
+
+    :param bool journal: Record the plan of the commit, and every file as it
+        is copied, in a :mod:`journal <sgpublish.journal>` within the publish
+        so that an interrupted commit may be finished by :meth:`resume`.
+
+    :param progress_callback: Called as ``progress_callback(publisher, phase,
+        done, total)`` during the commit, where ``phase`` is ``"copy"`` (with
+        counts of files), ``"tag"``, ``"promote"``, or ``"done"``.
+
+    .. attribute:: timings
+
+        Wall-clock seconds spent in each phase of the publish, keyed by:
+        ``"fetch_template"``, ``"guess_user"``, ``"version_lookup"``,
+        ``"fetch_core"``, ``"check_tags"``, ``"create"``,
+        ``"pick_directory"``, ``"preflight"``, ``"copy"``, ``"manifest"``,
+        ``"lock"``, ``"update"``, ``"thumbnail_downscale"``, ``"thumbnail"``,
+        ``"tag"``, and ``"promote"``.
+        Phases which overlap (e.g. the Shotgun update runs while files are
+        copied) are each timed in full.
+
+    .. attribute:: counters
+
+        ``"files_copied"``, ``"bytes_copied"``, and ``"shotgun_requests"``
+        (made by the publisher itself, i.e. not counting the review promotion).
+
+    Both are written into the ``sgpublish`` metadata of the tag, and every
+    publisher is passed to the :data:`timing_handlers` once committed.
+
     """
 
     def __init__(self, link=None, type=None, name=None, version=None, parent=None,
@@ -95,12 +382,17 @@ class Publisher(object):
                 sgfs = SGFS()
         self.sgfs = sgfs
 
+        # Wall-clock seconds spent in each phase, and how much work was done.
+        self.timings = {}
+        self.counters = {'bytes_copied': 0, 'files_copied': 0, 'shotgun_requests': 0}
+        self._timings_lock = threading.Lock()
+
         if template:
 
             template = sgfs.session.merge(template)
             to_fetch = ['sg_link', 'sg_type', 'code', 'sg_version']
             to_fetch.extend(_kwarg_to_field.itervalues())
-            template.fetch(to_fetch)
+            self._call_shotgun('fetch_template', template.fetch, to_fetch)
 
             tpl_link, tpl_type, tpl_name, tpl_version = template.get(('sg_link', 'sg_type', 'code', 'sg_version'))
             link = link or tpl_link
@@ -114,17 +406,12 @@ class Publisher(object):
                 kwargs.setdefault(key, template.get(field))
 
             if not kwargs.get('thumbnail_path'):
-                # We certainly jump through a lot of hoops to do this...
-                # Perhaps this should be sgfs.get_entity_tags(entity)
-                publish_path = sgfs.path_for_entity(template)
-                if publish_path:
-                    tags = sgfs.get_directory_entity_tags(publish_path)
-                    tags = [tag for tag in tags if tag['entity'] == template]
-                    if tags:
-                        meta = tags[0].get('sgpublish', {})
-                        thumbnail = meta.get('thumbnail')
-                        if thumbnail:
-                            kwargs['thumbnail_path'] = os.path.join(publish_path, thumbnail)
+                publish_path, tag = tagcache.get_entity_tag(sgfs, template)
+                if tag:
+                    meta = tag.get('sgpublish', {})
+                    thumbnail = meta.get('thumbnail')
+                    if thumbnail:
+                        kwargs['thumbnail_path'] = os.path.join(publish_path, thumbnail)
 
         if not (link and type and name):
             raise ValueError('requires link, type, and name')
@@ -148,11 +435,68 @@ class Publisher(object):
         # Will be set into the tag.
         self.metadata = {}
 
-        # Files to copy on commit; (src_path, dst_path)
+        # Larger sg_metadata is spilled into a sidecar; None never spills.
+        self.metadata_max_size = kwargs.pop('metadata_max_size', metadata.DEFAULT_MAX_SIZE)
+
+        # Files to copy on commit; (src_path, dst_path, method)
         self._files = []
 
+        # Set by preflight.
+        self._estimated_bytes = None
+
+        # The dst_path of every queued file, for fast lookups.
+        self._queued_paths = set()
+
+        # How each file actually made it into the publish; {dst_path: method}
+        self._transfer_methods = {}
+
+        # How each file was asked to be added; {dst_path: method}
+        self._requested_methods = {}
+
+        # Files which were made read-only as they were copied.
+        self._locked_paths = set()
+
+        staged = kwargs.pop('staged', False)
+
+        # Created once the commit is planned.
+        self._journal_enabled = bool(kwargs.pop('journal', False))
+        self._journal = None
+
+        # Where the thumbnail was copied to within the publish.
+        self._thumbnail_name = None
+
+        # The downscaled copy of the thumbnail which is uploaded; 0 disables.
+        self.thumbnail_max_size = kwargs.pop('thumbnail_max_size', thumbnails.DEFAULT_MAX_SIZE)
+        self._small_thumbnail_name = None
+        self._small_thumbnail_future = None
+
+        self.cache_version = kwargs.pop('cache_version', False)
+
+        #: Called as ``progress_callback(publisher, phase, done, total)`` as
+        #: the commit progresses; may be called from other threads.
+        self.progress_callback = kwargs.pop('progress_callback', None)
+
+        self._commit_future = None
+
         self.lock_permissions = True
 
+        # How hard we may hit the filer.
+        self.io_class, io_settings = throttle.get_io_class(kwargs.pop('io_class', None))
+        bandwidth = self._bandwidth = kwargs.pop('bandwidth', None)
+        if bandwidth:
+            self._throttle = throttle.Throttle(throttle.parse_bandwidth(bandwidth))
+        else:
+            self._throttle = throttle.get_throttle(self.io_class)
+
+        self.copy_workers = int(kwargs.pop('copy_workers', None) or io_settings['copy_workers'] or DEFAULT_COPY_WORKERS)
+
+        # Resolved to an ObjectStore (or None) on first use.
+        self._object_store = kwargs.pop('dedupe', None) or None
+
+        # Checksums of files as they are copied in; {dst_path: digest}
+        self._checksum_algorithm = manifest.DEFAULT_ALGORITHM if kwargs.pop('checksums', True) else None
+        self._digests = {}
+
         # Set attributes from kwargs.
         for name in (
             'created_by',
@@ -175,13 +519,14 @@ class Publisher(object):
 
         # Required for normalizing.
         self._directory = None
+        self._staging_directory = None
 
         # Get everything into the right type before sending it to Shotgun.
         self._normalize_attributes()
 
         # Prep for async processes. We can do a lot of "frivolous" Shotgun
         # queries at the same time since we must do at least one.
-        executor = concurrent.futures.ThreadPoolExecutor(8)
+        executor = executors.get('shotgun')
         futures = []
 
         # Figure out the version number (async).
@@ -192,7 +537,7 @@ class Publisher(object):
 
         # Grab all data on the link (assuming that is all that is used when
         # creating publish templates).
-        futures.append(executor.submit(self.link.fetch_core))
+        futures.append(executor.submit(self._call_shotgun, 'fetch_core', self.link.fetch_core))
 
         # First stage of the publish: create an "empty" PublishEvent.
         initial_data = {
@@ -239,13 +584,20 @@ class Publisher(object):
 
         else:
             self._directory_supplied = False
-            self._directory = self.pick_unique_directory(makedirs=makedirs)
+            with self._timed('pick_directory'):
+                self._directory = self.pick_unique_directory(makedirs=makedirs)
 
         # If the directory is tagged with existing entities, then we cannot
         # proceed. This allows one to retire a publish and then overwrite it.
-        tags = self.sgfs.get_directory_entity_tags(self._directory)
-        if any(tag['entity'].exists() for tag in tags):
+        tags = tagcache.get_directory_entity_tags(self.sgfs, self._directory)
+        if any(self._call_shotgun('check_tags', tag['entity'].exists) for tag in tags):
             raise ValueError('directory is already tagged: %r' % self._directory)
+        self._retired_tags = tags
+
+        # The picked directory remains as an (empty) reservation, and will
+        # be replaced by the staging directory.
+        if staged and makedirs and not self._directory_supplied:
+            self._staging_directory = self._make_staging_directory()
 
     def iter_potential_directories(self, allow_existing=False):
         """Find unique directories using the template result as a base.
@@ -263,10 +615,25 @@ class Publisher(object):
 
         unique_iter = ('%s_%d' % (base_path, i) for i in itertools.count(1))
 
+        if allow_existing:
+            for path in itertools.chain([base_path], unique_iter):
+                yield path
+            return
+
+        # List the parent once instead of probing each name in turn, which
+        # is a round-trip per name on network filesystems. Anything created
+        # after this is caught by the EEXIST in pick_unique_directory.
+        parent = os.path.dirname(base_path)
+        try:
+            existing = set(os.listdir(parent))
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            existing = set()
+
         for path in itertools.chain([base_path], unique_iter):
-            if not allow_existing and os.path.exists(path):
-                continue
-            yield path
+            if os.path.basename(path) not in existing:
+                yield path
 
     def pick_unique_directory(self, makedirs=True):
         """Get a unique directory for the publish.
@@ -285,6 +652,30 @@ class Publisher(object):
                     continue
             return path
 
+    def _make_staging_directory(self):
+        parent, name = os.path.split(self._directory)
+        for i in itertools.count(1):
+            path = os.path.join(parent, '.%s.%d.%d.staging' % (name, os.getpid(), i))
+            try:
+                os.mkdir(path)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+                continue
+            return path
+
+    def _unstage_path(self, path):
+        """Translate a path within the staging directory to its final location."""
+        staging = self._staging_directory
+        if path and staging and (path == staging or path.startswith(staging + os.sep)):
+            return self._directory + path[len(staging):]
+        return path
+
+    def _unstage(self):
+        """Atomically replace the reserved directory with the staging one."""
+        os.rename(self._staging_directory, self._directory)
+        self._staging_directory = None
+
     def assert_entities(self, _extra=None, _executor=None):
 
         # Create the review version stub (async).
@@ -297,41 +688,60 @@ class Publisher(object):
 
         if not self.entity['id']:
 
-            data = dict(self.entity)
-            data.pop('type')
-            data.pop('id')
-            if _extra:
-                data.update(_extra)
+            data = self._stage_one_data(_extra)
 
             try:
-                self.entity = self.sgfs.session.create('PublishEvent', data)
+                self.entity = self._call_shotgun('create', self.sgfs.session.create, 'PublishEvent', data)
             except ShotgunFault:
-                if not self.link.exists():
+                if not self._call_shotgun('check_link', self.link.exists):
                     raise RuntimeError('%s %d (%r) has been retired' % (self.link['type'], self.link['id'], self.link.get('name')))
                 else:
                     raise
 
         return future
 
+    def _stage_one_data(self, extra=None):
+        """The data to create our PublishEvent with."""
+        data = dict(self.entity)
+        data.pop('type')
+        data.pop('id')
+        if extra:
+            data.update(extra)
+        return data
+
+    def _stream_key(self):
+        return (self.link['type'], self.link['id'], self.type, self.name)
 
     def _set_automatic_version(self):
 
-        existing_entities = self.sgfs.session.find(
+        if self.cache_version:
+            head = _stream_heads.get(self._stream_key())
+            if head is not None:
+                self._version = head['sg_version'] + 1
+                self._parent = head
+                return
+
+        # Only count non-failed commits.
+        latest = self._call_shotgun('version_lookup', self.sgfs.session.find_one,
             'PublishEvent',
             [
                 ('sg_link', 'is', self.link),
                 ('sg_type', 'is', self.type),
                 ('code', 'is', self.name),
+                ('sg_version', 'greater_than', 0),
             ],
             ['sg_version', 'created_at'],
+            order=[
+                {'field_name': 'sg_version', 'direction': 'desc'},
+                {'field_name': 'created_at', 'direction': 'desc'},
+            ],
         )
 
-        self._version = 1
-        for e in existing_entities:
-            # Only increment for non-failed commits.
-            if e['sg_version']:
-                self._version = e['sg_version'] + 1
-                self._parent = e
+        if latest:
+            self._version = latest['sg_version'] + 1
+            self._parent = latest
+        else:
+            self._version = 1
 
     def _normalize_url(self, url):
         if url is None:
@@ -344,7 +754,8 @@ class Publisher(object):
 
     def _normalize_attributes(self):
 
-        self.created_by = self.created_by or self.sgfs.session.guess_user()
+        if not self.created_by:
+            self.created_by = self._call_shotgun('guess_user', self.sgfs.session.guess_user)
         self.description = str(self.description or '') or None
         self.movie_url = self._normalize_url(self.movie_url) or None
         self.source_publishes = self.source_publishes if self.source_publishes is not None else []
@@ -361,9 +772,9 @@ class Publisher(object):
 
         # Descriptive paths are relative to the directory.
         if self._directory is not None:
-            self.frames_path = os.path.join(self._directory, self.frames_path) if self.frames_path else None
-            self.movie_path = os.path.join(self._directory, self.movie_path) if self.movie_path else None
-            self.path = os.path.join(self._directory, self.path) if self.path else None
+            self.frames_path = os.path.join(self.directory, self.frames_path) if self.frames_path else None
+            self.movie_path = os.path.join(self.directory, self.movie_path) if self.movie_path else None
+            self.path = os.path.join(self.directory, self.path) if self.path else None
 
     @property
     def type(self):
@@ -399,17 +810,33 @@ class Publisher(object):
 
     @property
     def directory(self):
-        """The path into which all files must be placed."""
-        return self._directory
+        """The path into which all files must be placed.
+
+        This is the staging directory for staged publishes until they are
+        committed; see :attr:`final_directory`.
+
+        """
+        return self._staging_directory or self._directory
 
     @directory.setter
     def directory(self, value):
+        if self._staging_directory:
+            try:
+                os.rmdir(self._staging_directory)
+            except OSError as e:
+                log.warning('could not remove staging directory: %s' % e)
+            self._staging_directory = None
         self._directory_supplied = True
         self._directory = os.path.abspath(value)
 
+    @property
+    def final_directory(self):
+        """The path the publish will have once committed."""
+        return self._directory
+
     def isabs(self, dst_name):
         """Is the given path absolute and within the publish directory?"""
-        return dst_name.startswith(self._directory)
+        return dst_name.startswith(self.directory)
 
     def abspath(self, dst_name):
         """Get the abspath of the given name within the publish directory.
@@ -420,7 +847,7 @@ class Publisher(object):
         if self.isabs(dst_name):
             return dst_name
         else:
-            return os.path.join(self._directory, dst_name.lstrip('/'))
+            return os.path.join(self.directory, dst_name.lstrip('/'))
 
     def add_file(self, src_path, dst_name=None, make_unique=False, method='copy', immediate=False):
         """Queue a file (or folder) to be copied into the publish.
@@ -428,11 +855,18 @@ class Publisher(object):
         :param str src_path: The path to copy into the publish.
         :param dst_name: Where to copy it to.
         :type dst_name: str or None.
+        :param str method: How to get the file into the publish; one of
+            ``"copy"``, ``"move"``, ``"placeholder"``, ``"hardlink"``,
+            ``"reflink"``, or ``"auto"``. See :mod:`sgpublish.transfer`.
 
         ``dst_name`` will default to the basename of the source path. ``dst_name``
         will be treated as relative to the :attr:`.path` if it is not contained
         withing the :attr:`.directory`.
 
+        The method actually used for each file is recorded in the
+        :class:`~sgpublish.manifest.Manifest`, or, without one, in the
+        ``sgpublish.methods`` of the tag if it differs from ``method``.
+
         """
         dst_name = dst_name or os.path.basename(src_path)
         if make_unique:
@@ -441,30 +875,175 @@ class Publisher(object):
             raise ValueError('the file already exists in the publish')
         dst_path = self.abspath(dst_name)
 
-        if method not in ('copy', 'move', 'placeholder'):
+        if method not in transfer.METHODS:
             raise ValueError('bad add_file method %r' % method)
 
         if immediate:
             self._add_file(src_path, dst_path, method)
         else:
             self._files.append((src_path, dst_path, method))
+            self._queued_paths.add(dst_path)
 
         return dst_path
 
-    def _add_file(self, src_path, dst_path, method):
+    def _add_file(self, src_path, dst_path, method, lock=False):
 
         dst_dir = os.path.dirname(dst_path)
         if not os.path.exists(dst_dir):
             os.makedirs(dst_dir)
 
-        if method == 'copy':
-            shutil.copy(src_path, dst_path)
-        elif method == 'move':
-            shutil.move(src_path, dst_path)
-        elif method == 'placeholder':
-            pass # Just a placeholder.
-        else:
-            raise RuntimeError('bad add_file method %r' % method)
+        used_method = digest = None
+        if method in ('copy', 'auto') and os.path.isfile(src_path):
+            store = self._get_object_store()
+            if store is not None:
+                try:
+                    digest = store.link(src_path, dst_path, throttle=self._throttle)
+                except OSError as e:
+                    if e.errno != errno.EXDEV:
+                        raise
+                    log.warning('object store %s is not on the same filesystem as %s; not deduplicating' % (store.root, dst_path))
+                    self._object_store = None
+                else:
+                    used_method = 'dedupe'
+                    if self._checksum_algorithm != dedupe.DIGEST_ALGORITHM:
+                        digest = None # Don't read it back just to hash it again.
+
+        if not used_method:
+            used_method, digest = transfer.transfer(src_path, dst_path, method, self._checksum_algorithm, lock, self._throttle)
+
+        # Objects in the store are always locked. Moved directories are not,
+        # as only the directory itself (and not its contents) was touched.
+        if (lock or used_method == 'dedupe') and used_method != 'placeholder':
+            if not (used_method == 'move' and os.path.isdir(dst_path)):
+                self._locked_paths.add(dst_path)
+
+        self._transfer_methods[dst_path] = used_method
+        self._requested_methods[dst_path] = method
+        if self._checksum_algorithm and digest:
+            self._digests[dst_path] = digest
+        return used_method
+
+    def _get_object_store(self):
+        if self._object_store is True:
+            self._object_store = dedupe.ObjectStore.for_project(self.sgfs, self.link.project())
+            if self._object_store is None:
+                log.warning('project for %s is not on disk; not deduplicating' % self.directory)
+        return self._object_store
+
+    def _copy_files(self):
+        """Copy all queued files into the publish via a pool of workers.
+
+        The first failure is re-raised (after the other workers have been
+        cancelled or have finished) so that the commit will rollback.
+
+        """
+        copy_files([self], self.copy_workers)
+
+    def _write_manifest(self):
+        """Record the size of every file in the publish, and checksums from the copy.
+
+        Anything else in the directory (e.g. written directly by an exporter)
+        is only recorded by size, so that it is not read back in full.
+
+        """
+
+        methods = self._transfer_methods
+        manifest_ = manifest.Manifest(self.directory, self._checksum_algorithm)
+        for path, digest in self._digests.iteritems():
+            manifest_.add(path, digest=digest, method=methods.get(path))
+
+        # Placeholders are likely still being written by someone else.
+        skip = set(path for path, method in self._transfer_methods.iteritems() if method == 'placeholder')
+        skip.add(manifest_.path)
+        skip.add(os.path.join(self.directory, journal.JOURNAL_NAME))
+
+        # The contents of moved directories were moved with them.
+        dir_methods = {}
+
+        for dir_path, dir_names, file_names in os.walk(self.directory):
+            dir_method = methods.get(dir_path) or dir_methods.get(os.path.dirname(dir_path))
+            if dir_method:
+                dir_methods[dir_path] = dir_method
+            for file_name in file_names:
+                path = os.path.join(dir_path, file_name)
+                if path in skip or path in self._digests or file_name.startswith('.sgfs'):
+                    continue
+                manifest_.add(path, compute_digest=False, method=methods.get(path, dir_method))
+
+        manifest_.save()
+        return manifest_
+
+    def _lock_permissions(self):
+        """Lock everything which wasn't already locked while it was copied."""
+        with self._timed('lock'):
+            skip = set(self._locked_paths)
+            if self._journal is not None:
+                skip.add(self._journal.path) # Still being written.
+            transfer.lock_tree(self.directory, skip=skip)
+        log.info('locked permissions in %.2fs (%d files were locked during copy)' % (
+            self.timings['lock'], len(self._locked_paths),
+        ))
+
+    def _timed_add_file(self, src_path, dst_path, method):
+
+        start_time = time.time()
+        method = self._add_file(src_path, dst_path, method, lock=self.lock_permissions)
+        elapsed = time.time() - start_time
+
+        if self._journal is not None:
+            self._journal.record(dst_path, method, self._digests.get(dst_path))
+
+        size = 0 if method == 'placeholder' else utils.get_size(dst_path)
+        log.debug('%s %s to %s (%s in %.2fs at %s/s)' % (
+            method, src_path, dst_path,
+            utils.format_bytes(size),
+            elapsed,
+            utils.format_bytes(size / elapsed if elapsed else 0),
+        ))
+
+        with self._timings_lock:
+            self.counters['files_copied'] += 1
+            self.counters['bytes_copied'] += size
+            files_copied = self.counters['files_copied']
+
+        self._report_progress('copy', files_copied, len(self._files))
+
+        return size
+
+    def _report_progress(self, phase, done=0, total=0):
+        if self.progress_callback is None:
+            return
+        try:
+            self.progress_callback(self, phase, done, total)
+        except Exception:
+            log.exception('error in progress callback')
+
+    @contextlib.contextmanager
+    def _timed(self, phase):
+        """Add the time spent within this context to :attr:`timings`."""
+        start_time = time.time()
+        try:
+            yield
+        finally:
+            self._record_timing(phase, time.time() - start_time)
+
+    def _record_timing(self, phase, elapsed, shotgun_requests=0):
+        # Phases may run in several threads at once (e.g. creating the review
+        # Version alongside the PublishEvent), so their times are summed.
+        with self._timings_lock:
+            self.timings[phase] = self.timings.get(phase, 0) + elapsed
+            self.counters['shotgun_requests'] += shotgun_requests
+
+    def _call_shotgun(self, phase, func, *args, **kwargs):
+        """Call ``func`` as a Shotgun request via the :mod:`.governor`, counting and timing it."""
+        start_time = time.time()
+        try:
+            if phase in _idempotent_phases:
+                return governor.call_idempotent(func, *args, **kwargs)
+            else:
+                return governor.call(func, *args, **kwargs)
+        finally:
+            self._record_timing(phase, time.time() - start_time, 1)
 
     def add_files(self, files, relative_to=None, **kwargs):
 
@@ -489,7 +1068,7 @@ class Publisher(object):
     def file_exists(self, dst_name):
         """If added via :meth:`.add_file`, would it clash with an existing file?"""
         dst_path = self.abspath(dst_name)
-        return os.path.exists(dst_path) or any(x[1] == dst_path for x in self._files)
+        return dst_path in self._queued_paths or os.path.lexists(dst_path)
 
     def unique_name(self, dst_name):
         """Append numbers to the end of the name if nessesary to make the name
@@ -504,6 +1083,56 @@ class Publisher(object):
             if not self.file_exists(unique_name):
                 return unique_name
 
+    @property
+    def estimated_bytes(self):
+        """How many bytes the queued files will take to copy in, as measured
+        by :meth:`preflight` (which :meth:`commit` runs), or ``None``.
+
+        This is an upper bound, since ``"auto"`` transfers may not need to
+        copy at all.
+
+        """
+        return self._estimated_bytes
+
+    def preflight(self):
+        """Measure the queued files, and check there is room for them.
+
+        :raises OSError: ``ENOSPC`` if the destination is too full.
+        :returns: :attr:`estimated_bytes`
+
+        """
+        return preflight([self])
+
+    @property
+    def commit_future(self):
+        """The :class:`~concurrent.futures.Future` from :meth:`commit_async`, or ``None``."""
+        return self._commit_future
+
+    def commit_async(self, progress_callback=None):
+        """Run :meth:`commit` in the background.
+
+        The commit runs on the shared ``"commit"`` pool of
+        :mod:`sgpublish.executors`; failures roll back exactly as they would
+        for :meth:`commit`, and are raised by the future's ``result()``.
+
+        :param progress_callback: Replaces :attr:`progress_callback`.
+        :returns: A :class:`~concurrent.futures.Future` which resolves to this
+            publisher once it has committed.
+
+        """
+
+        if self._committed or self._commit_future is not None:
+            raise ValueError('publish already comitted')
+        if progress_callback is not None:
+            self.progress_callback = progress_callback
+
+        self._commit_future = executors.get('commit').submit(self._commit_and_return)
+        return self._commit_future
+
+    def _commit_and_return(self):
+        self.commit()
+        return self
+
     def commit(self):
 
         # As soon as one publish attempt is made, we force a full retry.
@@ -514,67 +1143,38 @@ class Publisher(object):
         # Cleanup all user-settable attributes that are sent to Shotgun.
         self._normalize_attributes()
 
+        # Fail before we touch Shotgun (or the directory) if it won't fit.
         try:
+            with self._timed('preflight'):
+                self.preflight()
+        except:
+            rollback_many([self], discard_empty=True)
+            raise
 
-            updates = {
-                'description': self.description,
-                'sg_path': self.path,
-                'sg_path_to_frames': self.frames_path,
-                'sg_path_to_movie': self.movie_path,
-                'sg_qt': self.movie_url,
-                'sg_source_publishes': self.source_publishes or [],
-                'sg_trigger_event_id': self.trigger_event['id'] if self.trigger_event else None,
-                'sg_version': self._version,
-                'sg_metadata': json.dumps(self.metadata),
-            }
-            updates.update(self.extra_fields)
-
-            if self.entity['id']:
-                # Force the updated into the entity for the tag, since the Shotgun
-                # update may not complete by the time that we tag the directory
-                # or promote for review.
-                self.entity.update(updates)
-            else:
-                self.assert_entities(_extra=updates)
-
-            executor = concurrent.futures.ThreadPoolExecutor(4)
-            futures = []
+        try:
 
-            # Start the second stage of the publish.
-            futures.append(executor.submit(self.sgfs.session.update,
-                'PublishEvent',
-                self.entity['id'],
-                updates,
-            ))
+            updates = self._prepare_commit()
+            staged = bool(self._staging_directory)
 
-            if self.thumbnail_path:
+            executor = executors.get('shotgun')
+            futures = []
 
-                # Start the thumbnail upload in the background.
-                futures.append(executor.submit(self.sgfs.session.upload_thumbnail,
-                    self.entity['type'],
+            # Start the second stage of the publish. Staged publishes must
+            # wait until their files are in place.
+            if not staged:
+                futures.append(executor.submit(self._call_shotgun, 'update', self.sgfs.session.update,
+                    'PublishEvent',
                     self.entity['id'],
-                    self.thumbnail_path,
+                    updates,
                 ))
 
-                # Schedule it for copy.
-                thumbnail_name = os.path.relpath(self.thumbnail_path, self.directory)
-                if thumbnail_name.startswith('.'):
-                    thumbnail_name = 'thumbnail' + os.path.splitext(self.thumbnail_path)[1]
-                    thumbnail_name = self.add_file(
-                        self.thumbnail_path,
-                        thumbnail_name,
-                        make_unique=True
-                    )
+            # Start the thumbnail upload in the background.
+            if self.thumbnail_path:
+                futures.append(executor.submit(self._upload_thumbnail))
 
             # Copy in the scheduled files.
-            for file_args in self._files:
-                self._add_file(*file_args)
-
-            # Set permissions. I would like to own it by root, but we need root
-            # to do that. We also leave the directory writable, but sticky.
-            if self.lock_permissions:
-                check_call(['chmod', '-R', 'a=rX', self._directory])
-                check_call(['chmod', 'a+t,u+w', self._directory])
+            self._copy_files()
+            self._finish_files()
 
             # Wait for the Shotgun updates.
             for future in futures:
@@ -583,43 +1183,386 @@ class Publisher(object):
             # Tag the directory. Ideally we would like to do this before the
             # futures are waited for, but we only want to tag the directory
             # if everything was successful.
-            our_metadata = {}
-            if self._parent:
-                our_metadata['parent'] = self.sgfs.session.merge(self._parent).minimal
-            if self.thumbnail_path:
-                our_metadata['thumbnail'] = thumbnail_name.encode('utf8') if isinstance(thumbnail_name, unicode) else thumbnail_name
-            full_metadata = dict(self.metadata)
-            full_metadata['sgpublish'] = our_metadata
-            self.sgfs.tag_directory_with_entity(self._directory, self.entity, full_metadata)
+            self._tag_directory()
 
-            # Again, we would like to do with with the futures, but the current
-            # version of this depends on the directory being tagged.
-            if self._review_version_fields is not None:
-                self._promote_for_review()
+            if staged:
+                self._call_shotgun('update', self.sgfs.session.update, 'PublishEvent', self.entity['id'], updates)
 
+            self._finish_commit()
 
         except:
             self.rollback()
             raise
 
+    def _prepare_commit(self):
+        """Assert the PublishEvent exists, and schedule the thumbnail.
+
+        :returns: The second stage updates for the PublishEvent.
+
+        """
+
+        # Point Shotgun at where staged files will end up.
+        self.path = self._unstage_path(self.path)
+        self.frames_path = self._unstage_path(self.frames_path)
+        self.movie_path = self._unstage_path(self.movie_path)
+
+        updates = {
+            'description': self.description,
+            'sg_path': self.path,
+            'sg_path_to_frames': self.frames_path,
+            'sg_path_to_movie': self.movie_path,
+            'sg_qt': self.movie_url,
+            'sg_source_publishes': self.source_publishes or [],
+            'sg_trigger_event_id': self.trigger_event['id'] if self.trigger_event else None,
+            'sg_version': self._version,
+            'sg_metadata': metadata.encode(self.metadata, self.directory, self._directory, self.metadata_max_size),
+        }
+        updates.update(self.extra_fields)
+
+        if self.entity['id'] or self._staging_directory:
+            if not self.entity['id']:
+                # Staged publishes must not look finished until their files
+                # are in place, so they get the updates after tagging.
+                self.assert_entities()
+            # Force the updated into the entity for the tag, since the Shotgun
+            # update may not complete by the time that we tag the directory
+            # or promote for review.
+            self.entity.update(updates)
+        else:
+            self.assert_entities(_extra=updates)
+
+        # Resumed publishes have already scheduled it.
+        if self.thumbnail_path and self._thumbnail_name is None:
+
+            # Schedule it for copy.
+            thumbnail_name = os.path.relpath(self.thumbnail_path, self.directory)
+            if thumbnail_name.startswith('.'):
+                thumbnail_name = 'thumbnail' + os.path.splitext(self.thumbnail_path)[1]
+                thumbnail_name = self.add_file(
+                    self.thumbnail_path,
+                    thumbnail_name,
+                    make_unique=True
+                )
+            self._thumbnail_name = os.path.relpath(self.abspath(thumbnail_name), self.directory)
+
+        # Downscale it (in a subprocess) while everything else is copied.
+        if self.thumbnail_path and self.thumbnail_max_size and self._small_thumbnail_future is None:
+            if self._small_thumbnail_name:
+                # Resumed publishes remake it under the same name, since the
+                # last attempt may have been interrupted while writing it.
+                small_path = self.abspath(self._small_thumbnail_name)
+                if os.path.lexists(small_path):
+                    os.unlink(small_path)
+            else:
+                self._small_thumbnail_name = self.unique_name(thumbnails.SMALL_NAME)
+            self._small_thumbnail_future = executors.get('io').submit(self._make_small_thumbnail)
+
+        if self._journal_enabled and self._journal is None:
+            self._journal = journal.Journal(self.directory)
+            self._journal.start(self._journal_plan(updates))
+
+        return updates
+
+    def _journal_plan(self, updates):
+        """Everything :meth:`resume` needs to rebuild this publisher."""
+        minimal = lambda entity: self.sgfs.session.merge(entity).minimal if entity else None
+        store = self._object_store
+        return {
+            'entity': self.entity.minimal,
+            'link': self.link.minimal,
+            'type': self.type,
+            'name': self.name,
+            'version': self._version,
+            'parent': minimal(self._parent),
+            'directory': self._directory,
+            'directory_supplied': self._directory_supplied,
+            'staging_directory': self._staging_directory,
+            'attributes': {
+                'created_by': minimal(self.created_by),
+                'description': self.description,
+                'extra_fields': self.extra_fields,
+                'frames_path': self.frames_path,
+                'lock_permissions': self.lock_permissions,
+                'movie_path': self.movie_path,
+                'movie_url': self.movie_url,
+                'path': self.path,
+                'source_publish': minimal(self.source_publish),
+                'source_publishes': [minimal(x) for x in self.source_publishes],
+                'thumbnail_path': self.thumbnail_path,
+                'trigger_event': self.trigger_event,
+            },
+            # Constructor options which affect the commit.
+            'options': {
+                'bandwidth': self._bandwidth,
+                'checksums': bool(self._checksum_algorithm),
+                'copy_workers': self.copy_workers,
+                'dedupe': store.root if isinstance(store, dedupe.ObjectStore) else bool(store),
+                'io_class': self.io_class,
+                'metadata_max_size': self.metadata_max_size,
+                'review_version_fields': self._review_version_fields,
+                'thumbnail_max_size': self.thumbnail_max_size,
+            },
+            'metadata': self.metadata,
+            'review_version_entity': minimal(self._review_version_entity),
+            'thumbnail_name': self._thumbnail_name,
+            'small_thumbnail_name': self._small_thumbnail_name,
+            'files': self._files,
+        }
+
+    @classmethod
+    def resume(cls, directory, sgfs=None):
+        """Finish the commit of a journaled publish which was interrupted.
+
+        Reattaches to the same ``PublishEvent``, skips every file which the
+        journal shows as completely copied (and unchanged since), and commits.
+
+        :param str directory: The publish (or staging) directory which
+            contains the journal.
+        :returns: The committed :class:`Publisher`.
+
+        """
+
+        journal_ = journal.Journal.load(directory)
+        if journal_ is None:
+            raise ValueError('no journal in %r' % directory)
+        plan = journal_.plan
+
+        kwargs = dict((str(k), v) for k, v in plan['attributes'].iteritems())
+        kwargs.update((str(k), v) for k, v in plan['options'].iteritems())
+        if isinstance(kwargs['dedupe'], basestring):
+            kwargs['dedupe'] = dedupe.ObjectStore(kwargs['dedupe'])
+        publisher = cls(
+            link=plan['link'],
+            type=plan['type'],
+            name=plan['name'],
+            version=plan['version'],
+            parent=plan['parent'],
+            directory=plan['directory'],
+            sgfs=sgfs,
+            makedirs=False,
+            defer_entities=True,
+            **kwargs
+        )
+        session = publisher.sgfs.session
+
+        # Become the stub which the interrupted commit created.
+        data = dict(publisher.entity)
+        data['id'] = plan['entity']['id']
+        publisher.entity = session.merge(data)
+        if plan['review_version_entity']:
+            publisher._review_version_entity = session.merge(plan['review_version_entity'])
+
+        publisher.metadata = plan['metadata']
+        publisher._directory_supplied = plan['directory_supplied']
+        publisher._staging_directory = plan['staging_directory']
+        publisher._thumbnail_name = plan['thumbnail_name']
+        publisher._small_thumbnail_name = plan['small_thumbnail_name']
+        publisher._journal_enabled = True
+        publisher._journal = journal_
+
+        skipped = 0
+        for src_path, dst_path, method in plan['files']:
+            if journal_.is_complete(dst_path):
+                record = journal_.completed[dst_path]
+                publisher._transfer_methods[dst_path] = record['method']
+                publisher._requested_methods[dst_path] = method
+                if record['digest'] and publisher._checksum_algorithm:
+                    publisher._digests[dst_path] = record['digest']
+                if publisher.lock_permissions and record['method'] != 'placeholder' and not os.path.isdir(dst_path):
+                    publisher._locked_paths.add(dst_path)
+                skipped += 1
+                continue
+            if method == 'move' and os.path.lexists(dst_path) and not os.path.lexists(src_path):
+                # Moves are atomic; it finished but wasn't journaled.
+                publisher._transfer_methods[dst_path] = method
+                publisher._requested_methods[dst_path] = method
+                skipped += 1
+                continue
+            # Anything partially copied must go.
+            if os.path.lexists(dst_path) and not os.path.isdir(dst_path):
+                os.unlink(dst_path)
+            publisher._files.append((src_path, dst_path, method))
+            publisher._queued_paths.add(dst_path)
+
+        log.info('resuming publish %d; %d of %d files were already copied' % (
+            publisher.entity['id'], skipped, len(plan['files']),
+        ))
+
+        publisher.commit()
+        return publisher
+
+    def _make_small_thumbnail(self):
+        with self._timed('thumbnail_downscale'):
+            path = thumbnails.downscale(
+                self.thumbnail_path,
+                self.abspath(self._small_thumbnail_name),
+                self.thumbnail_max_size,
+            )
+        if path is None:
+            self._small_thumbnail_name = None
+        return path
+
+    def _upload_thumbnail(self):
+        """Upload the downscaled thumbnail, or the original if that failed."""
+        path = self._small_thumbnail_future.result() if self._small_thumbnail_future else None
+        return self._call_shotgun('thumbnail', self.sgfs.session.upload_thumbnail,
+            self.entity['type'],
+            self.entity['id'],
+            path or self.thumbnail_path,
+        )
+
+    def _finish_files(self):
+        """Write the manifest and lock permissions once all files are in."""
+
+        # The small thumbnail is written straight into the publish.
+        if self._small_thumbnail_future is not None:
+            self._small_thumbnail_future.result()
+
+        if self._checksum_algorithm:
+            with self._timed('manifest'):
+                self._write_manifest()
+
+        # Set permissions. I would like to own it by root, but we need root
+        # to do that. We also leave the directory writable, but sticky.
+        if self.lock_permissions:
+            self._lock_permissions()
+
+    def _tag_directory(self):
+        """Move staged files into place, and tag the directory."""
+
+        self._report_progress('tag')
+
+        thumbnail_name = self._thumbnail_name
+
+        our_metadata = {}
+        if self._parent:
+            our_metadata['parent'] = self.sgfs.session.merge(self._parent).minimal
+        if self.thumbnail_path:
+            our_metadata['thumbnail'] = thumbnail_name.encode('utf8') if isinstance(thumbnail_name, unicode) else thumbnail_name
+            if self._small_thumbnail_name:
+                our_metadata['thumbnail_small'] = str(self._small_thumbnail_name)
+        if self._checksum_algorithm:
+            our_metadata['manifest'] = manifest.MANIFEST_NAME
+        else:
+            # Every file is in the manifest; without one, only the surprises
+            # are recorded, as every reader of the tag has to parse it.
+            methods = dict(
+                (os.path.relpath(path, self.directory), method)
+                for path, method in self._transfer_methods.iteritems()
+                if method != self._requested_methods.get(path)
+            )
+            if methods:
+                our_metadata['methods'] = methods
+        # Only what has happened so far; the tag is written before the
+        # review promotion (and the Shotgun update of staged publishes).
+        our_metadata['timings'] = dict(self.timings)
+        our_metadata['counters'] = dict(self.counters)
+        full_metadata = dict(self.metadata)
+        full_metadata['sgpublish'] = our_metadata
+
+        with self._timed('tag'):
+            retired_tags = self._retired_tags
+            if self._staging_directory:
+                self._unstage()
+                retired_tags = [] # It replaced an empty reservation.
+            self.sgfs.tag_directory_with_entity(self._directory, self.entity, full_metadata)
+
+        # It can't be resumed once tagged.
+        if self._journal is not None:
+            self._journal.directory = self._directory
+            self._journal.remove()
+
+        # So that promotion (and anything else in this process) need not read
+        # the tag back from disk. This is last, as it is stamped with the
+        # state of the directory.
+        tagcache.remember(self._directory, retired_tags + [dict(full_metadata, entity=self.entity)])
+
+    def _finish_commit(self):
+
+        # Remember the head of the stream for the next automatic version.
+        key = self._stream_key()
+        head = _stream_heads.get(key)
+        if head is None or head['sg_version'] < self._version:
+            _stream_heads[key] = dict(self.entity.minimal, sg_version=self._version)
+
+        # Again, we would like to do with with the futures, but the current
+        # version of this depends on the directory being tagged.
+        if self._review_version_fields is not None:
+            self._report_progress('promote')
+            with self._timed('promote'):
+                self._promote_for_review()
+
+        self._emit_timings()
+        self._report_progress('done')
+
+    def _emit_timings(self):
+        log.debug('publish %d timings: %s; counters: %s' % (
+            self.entity['id'],
+            ', '.join('%s=%.3fs' % x for x in sorted(self.timings.iteritems())),
+            ', '.join('%s=%d' % x for x in sorted(self.counters.iteritems())),
+        ))
+        for handler in timing_handlers:
+            try:
+                handler(self)
+            except Exception:
+                log.exception('error in timing handler %r' % handler)
+
     def __enter__(self):
         return self
 
     def rollback(self):
+        """Reset the version on Shotgun, and move the directory aside.
 
-        # Remove the entity's ID.
-        id_ = self.entity.pop('id', None) or 0
+        Both happen at once; see :func:`rollback_many` to roll back several
+        publishers together.
+
+        """
+        rollback_many([self])
 
-        # Attempt to set the version to 0 on Shotgun.
-        if id_ and self.entity.get('sg_version'):
-            self.sgfs.session.update('PublishEvent', id_, {'sg_version': 0})
+    def _pop_id(self):
+        """Forget the entity's ID.
 
-        # Move the folder aside.
-        if not self._directory_supplied and os.path.exists(self._directory):
+        :returns: ``(id, needs_reset)``, where ``needs_reset`` is if Shotgun
+            may have a non-zero version for it.
+
+        """
+        id_ = self.entity.pop('id', None) or 0
+        return id_, bool(id_ and self.entity.get('sg_version'))
+
+    def _move_aside(self, id_):
+        """Move the directory of a failed publish out of the way."""
+        if not self._directory_supplied and os.path.exists(self.directory):
             failed_directory = '%s.%d.failed' % (self._directory, id_)
-            check_call(['mv', self._directory, failed_directory])
+            os.rename(self.directory, failed_directory)
+            if self._staging_directory:
+                # Release our reservation.
+                self._staging_directory = None
+                try:
+                    os.rmdir(self._directory)
+                except OSError as e:
+                    log.warning('could not remove reserved directory: %s' % e)
             self._directory = failed_directory
 
+    def _discard_directory(self, id_):
+        """Remove the directory of a publish which failed before its files were copied.
+
+        It is only moved aside (see :meth:`_move_aside`) if something has
+        already been written into it.
+
+        """
+        if self._directory_supplied:
+            return
+        try:
+            if self._staging_directory:
+                os.rmdir(self._staging_directory)
+                self._staging_directory = None
+            if os.path.exists(self._directory):
+                os.rmdir(self._directory)
+        except OSError as e:
+            if e.errno not in (errno.ENOTEMPTY, errno.EEXIST):
+                raise
+            self._move_aside(id_)
+
     def __exit__(self, *exc_info):
         if exc_info and exc_info[0] is not None:
             self.rollback()
@@ -634,13 +1577,17 @@ class Publisher(object):
         """
 
         if self._review_version_entity is None:
-            self._review_version_entity = self.sgfs.session.create('Version', {
-                'code': 'stub for publishing',
-                'created_by': self.created_by,
-                'project': self.link.project(),
-            })
+            self._review_version_entity = self._call_shotgun('create', self.sgfs.session.create,
+                'Version', self._review_version_stub_data())
         return self._review_version_entity
 
+    def _review_version_stub_data(self):
+        return {
+            'code': 'stub for publishing',
+            'created_by': self.created_by,
+            'project': self.link.project(),
+        }
+
     def _promote_for_review(self):
         if not self._committed:
             raise RuntimeError('can only promote AFTER publishing commits')
@@ -4,6 +4,8 @@ import re
 
 from sgsession import Session
 
+from . import throttle
+
 
 def get_related_publishes(to_check, fields=()):
     """Find all publishes which derive from the given ones.
@@ -66,8 +68,17 @@ def _split_to_set(x):
 
 class RepublishEventPlugin(object):
 
-    def __init__(self, **kwargs):
+    """Republish PublishEvents as they are committed.
+
+    Republishes are given the ``io_class`` (``"farm"`` by default) unless they
+    request their own; see :mod:`sgpublish.throttle`. Those dispatched to Qube
+    get it via the ``SGPUBLISH_IO_CLASS`` environment variable of the job.
+
+    """
+
+    def __init__(self, io_class='farm', **kwargs):
 
+        self._io_class = io_class
         self._funcs = []
         self._dispatcher_kwargs = kwargs
         kwargs.setdefault('callback_in_subprocess', False)
@@ -184,12 +195,14 @@ class RepublishEventPlugin(object):
                     name=qube_name,
                     user=user,
                     priority=8000,
+                    env={'SGPUBLISH_IO_CLASS': self._io_class},
                 )
 
                 self.log.info('Qube job %d: %s' % (future.job_id, qube_name))
 
             else:
-                func(publish, *(args or ()), **(kwargs or {}))
+                with throttle.default_io_class(self._io_class):
+                    func(publish, *(args or ()), **(kwargs or {}))
 
             # Only run the first one!
             return
@@ -0,0 +1,123 @@
+"""Caching the tags of publish directories.
+
+Reading a tag means finding the directory of an entity and parsing the tag
+off of disk, which is slow on the filer; and promotion to a Version reads the
+very tag that the :class:`.Publisher` wrote moments before. Tags are cached
+per directory (and are re-read if the tag file within it has been modified
+since), and :meth:`.Publisher.commit` puts the tag it writes into the
+cache so that it is never read back from disk.
+
+Returned tags are shallow copies; their values must not be modified.
+
+"""
+
+import os
+import threading
+
+
+#: The file within a directory which sgfs stores tags in.
+TAG_NAME = '.sgfs.yml'
+
+#: The cache is cleared once it grows past this many directories.
+MAX_ENTRIES = 1024
+
+_tags = {} # {path: (stamp, tags)}
+_entity_paths = {} # {(type, id): path}
+_lock = threading.Lock()
+
+
+def _stamp(path):
+    # The tag file itself, so that other changes to the directory (e.g.
+    # removing the journal) don't invalidate it. Directories without one
+    # fall back to their own mtime.
+    try:
+        st = os.stat(os.path.join(path, TAG_NAME))
+    except OSError:
+        pass
+    else:
+        return 'tag', st.st_ino, st.st_size, st.st_mtime
+    try:
+        return 'dir', os.stat(path).st_mtime
+    except OSError:
+        return
+
+
+def _freeze(tag):
+    # Only the type and ID of the entity are kept, so that tags may be
+    # handed to any session.
+    entity = tag['entity']
+    return dict(tag, entity={'type': entity['type'], 'id': entity['id']})
+
+
+def _thaw(session, tag):
+    return dict(tag, entity=session.merge(tag['entity']))
+
+
+def _store(path, stamp, tags):
+    with _lock:
+        if len(_tags) >= MAX_ENTRIES:
+            _tags.clear()
+            _entity_paths.clear()
+        _tags[path] = (stamp, tags)
+        for tag in tags:
+            _entity_paths[(tag['entity']['type'], tag['entity']['id'])] = path
+
+
+def remember(path, tags):
+    """Cache the full list of tags that were just written to a directory."""
+    path = os.path.abspath(path)
+    stamp = _stamp(path)
+    if stamp is not None:
+        _store(path, stamp, [_freeze(tag) for tag in tags])
+
+
+def clear():
+    with _lock:
+        _tags.clear()
+        _entity_paths.clear()
+
+
+def get_directory_entity_tags(sgfs, path):
+    """Cached :meth:`sgfs.SGFS.get_directory_entity_tags`."""
+
+    path = os.path.abspath(path)
+    stamp = _stamp(path)
+
+    with _lock:
+        entry = _tags.get(path)
+    if entry is not None and stamp is not None and entry[0] == stamp:
+        tags = entry[1]
+    else:
+        tags = [_freeze(tag) for tag in sgfs.get_directory_entity_tags(path)]
+        if stamp is not None:
+            _store(path, stamp, tags)
+
+    return [_thaw(sgfs.session, tag) for tag in tags]
+
+
+def _find_tag(sgfs, path, key):
+    for tag in get_directory_entity_tags(sgfs, path):
+        if (tag['entity']['type'], tag['entity']['id']) == key:
+            return tag
+
+
+def get_entity_tag(sgfs, entity):
+    """Find the directory of an entity, and the tag of it within.
+
+    :returns: ``(path, tag)``; either may be ``None``.
+
+    """
+
+    key = (entity['type'], entity['id'])
+    with _lock:
+        path = _entity_paths.get(key)
+    if path:
+        tag = _find_tag(sgfs, path, key)
+        if tag is not None:
+            return path, tag
+
+    # Not cached (or it has since moved).
+    path = sgfs.path_for_entity(entity)
+    if not path:
+        return None, None
+    return path, _find_tag(sgfs, path, key)
@@ -0,0 +1,130 @@
+"""Limiting how hard publishes hit the filer.
+
+Every publish copies its files with an I/O class, which sets a bandwidth
+limit (shared by every publish of that class in this process) and how many
+files are copied at once:
+
+``"interactive"``
+    Artists waiting on their publish; unlimited.
+
+``"farm"``
+    Publishes from the farm, e.g. republishes.
+
+``"bulk"``
+    Large background jobs, e.g. migrations.
+
+The class is picked by (in order of precedence) the ``io_class`` of the
+:class:`.Publisher`, :func:`default_io_class`, the ``SGPUBLISH_IO_CLASS``
+environment variable, and finally :data:`DEFAULT_IO_CLASS`. The bandwidth of
+every class may be overridden by the ``SGPUBLISH_IO_BANDWIDTH`` environment
+variable (in bytes per second, or with a ``K``, ``M``, or ``G`` suffix).
+
+Only bytes which are actually copied are throttled; hardlinks, reflinks and
+moves within a filesystem are free.
+
+"""
+
+import contextlib
+import os
+import threading
+import time
+
+
+#: ``{name: {'bandwidth': bytes_per_second_or_None, 'copy_workers': int_or_None}}``
+IO_CLASSES = {
+    'interactive': {'bandwidth': None, 'copy_workers': None},
+    'farm': {'bandwidth': 200 * 1024 * 1024, 'copy_workers': 2},
+    'bulk': {'bandwidth': 50 * 1024 * 1024, 'copy_workers': 1},
+}
+
+#: The class used if nothing else is specified.
+DEFAULT_IO_CLASS = 'interactive'
+
+
+class Throttle(object):
+
+    """A token bucket which limits the rate that bytes pass through it.
+
+    It is safe to share between threads; their combined rate is limited.
+
+    :param float rate: Bytes per second.
+    :param float burst: How many bytes may pass at once after being idle;
+        defaults to one second's worth.
+
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst or rate)
+        self._tokens = self.burst
+        self._last = time.time()
+        self._lock = threading.Lock()
+
+    def consume(self, amount):
+        """Take ``amount`` bytes from the bucket, sleeping until they are available."""
+        with self._lock:
+            now = time.time()
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            # Go into debt so that concurrent callers queue up behind us.
+            self._tokens -= amount
+            delay = -self._tokens / self.rate if self._tokens < 0 else 0
+        if delay > 0:
+            time.sleep(delay)
+
+
+def parse_bandwidth(value):
+    """Parse ``"1048576"``, ``"1024K"``, ``"1M"``, etc., into bytes per second."""
+    value = str(value).strip().upper()
+    for i, suffix in enumerate('KMG'):
+        if value.endswith(suffix):
+            return float(value[:-1]) * 1024 ** (i + 1)
+    return float(value)
+
+
+_local = threading.local()
+
+
+@contextlib.contextmanager
+def default_io_class(name):
+    """Use the given class for publishes created in this thread within the context."""
+    get_io_class(name) # Assert it exists.
+    previous = getattr(_local, 'io_class', None)
+    _local.io_class = name
+    try:
+        yield
+    finally:
+        _local.io_class = previous
+
+
+def get_io_class(name=None):
+    """Resolve the name of an I/O class; see the module docs for precedence.
+
+    :returns: ``(name, settings)``
+
+    """
+    name = name or getattr(_local, 'io_class', None) or os.environ.get('SGPUBLISH_IO_CLASS') or DEFAULT_IO_CLASS
+    try:
+        return name, IO_CLASSES[name]
+    except KeyError:
+        raise ValueError('unknown I/O class %r; expected one of %s' % (name, ', '.join(sorted(IO_CLASSES))))
+
+
+_throttles = {}
+_throttles_lock = threading.Lock()
+
+
+def get_throttle(io_class=None):
+    """Get the :class:`Throttle` shared by every publish of a class, or ``None``."""
+
+    name, settings = get_io_class(io_class)
+    bandwidth = os.environ.get('SGPUBLISH_IO_BANDWIDTH')
+    bandwidth = parse_bandwidth(bandwidth) if bandwidth else settings['bandwidth']
+    if not bandwidth:
+        return
+
+    with _throttles_lock:
+        throttle = _throttles.get(name)
+        if throttle is None or throttle.rate != bandwidth:
+            throttle = _throttles[name] = Throttle(bandwidth)
+        return throttle
@@ -0,0 +1,60 @@
+"""Downscaling thumbnails before they are uploaded.
+
+Screenshots are taken at full resolution, which is far more than Shotgun (or
+any picker) will ever display. :func:`downscale` makes a small copy in an
+``ffmpeg`` subprocess, so that the work is kept off of the publishing (and
+often GUI) process.
+
+"""
+
+import errno
+import logging
+import os
+import subprocess
+
+
+log = logging.getLogger(__name__)
+
+
+#: The longest edge of downscaled thumbnails, in pixels.
+DEFAULT_MAX_SIZE = 512
+
+#: The name small thumbnails are given within publishes.
+SMALL_NAME = 'thumbnail_small.jpg'
+
+
+def downscale(src_path, dst_path, max_size=DEFAULT_MAX_SIZE):
+    """Write a JPEG of the given image which fits within ``max_size`` pixels.
+
+    Images are never scaled up.
+
+    :returns: ``dst_path``, or ``None`` if the image could not be converted
+        (e.g. ``ffmpeg`` is not installed).
+
+    """
+
+    scale = "scale='min(iw,{0})':'min(ih,{0})':force_original_aspect_ratio=decrease".format(int(max_size))
+    cmd = [
+        'ffmpeg', '-y',
+        '-loglevel', 'error',
+        '-i', src_path,
+        '-vf', scale,
+        '-frames:v', '1',
+        '-q:v', '3',
+        dst_path,
+    ]
+
+    try:
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+        log.warning('ffmpeg is not installed; not downscaling thumbnails')
+        return
+
+    output = proc.communicate()[0]
+    if proc.returncode or not os.path.exists(dst_path):
+        log.warning('could not downscale thumbnail %s: %s' % (src_path, output.strip()))
+        return
+
+    return dst_path
@@ -0,0 +1,262 @@
+"""Strategies for getting files into a publish.
+
+Each strategy takes a source and destination path. :func:`transfer` dispatches
+to them by name, and returns the name of the strategy that was actually used
+(which only differs from the requested one for ``"auto"``), along with a
+checksum of the file if one was requested and it was copied in userspace
+(where it is computed from the buffers being written).
+
+Files may also be locked (made read-only, like ``chmod a=rX``) as they are
+written, and :func:`lock_tree` locks everything else in a publish. Strategies
+which copy data may be given a :class:`~sgpublish.throttle.Throttle`.
+
+"""
+
+import errno
+import hashlib
+import logging
+import os
+import shutil
+import stat
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    from scandir import scandir
+except ImportError:
+    scandir = getattr(os, 'scandir', None)
+
+
+log = logging.getLogger(__name__)
+
+
+#: All methods understood by :func:`transfer`.
+METHODS = ('copy', 'move', 'placeholder', 'hardlink', 'reflink', 'auto')
+
+# The FICLONE ioctl from <linux/fs.h>.
+_FICLONE = 0x40049409
+
+# Errors which signal that a strategy isn't supported for these paths, and
+# that the next one should be tried.
+_unsupported_errnos = set(getattr(errno, name) for name in (
+    'EBADF',
+    'EINVAL',
+    'ENOSYS',
+    'ENOTSUP',
+    'ENOTTY',
+    'EOPNOTSUPP',
+    'EPERM',
+    'EXDEV',
+) if hasattr(errno, name))
+
+_writable_mask = stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH
+_exec_mask = stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH
+_read_mask = stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH
+
+_chunk_size = 1024 * 1024
+
+
+def locked_mode(mode, is_dir=False):
+    """The permission bits of ``chmod a=rX`` applied to the given mode."""
+    if is_dir or mode & _exec_mask:
+        return _read_mask | _exec_mask
+    return _read_mask
+
+
+def _set_mode(src_path, dst_path, lock):
+    if lock:
+        os.chmod(dst_path, locked_mode(os.stat(src_path).st_mode))
+    else:
+        shutil.copymode(src_path, dst_path)
+
+
+def lock_tree(root, skip=()):
+    """Make everything under ``root`` read-only, like ``chmod -R a=rX``.
+
+    The root itself is left writable by its owner and sticky (``a+t,u+w``)
+    so that it may still be tagged.
+
+    :param skip: Files which are already locked, so their modes don't need
+        to be set again. If :mod:`scandir` is availible, these cost no
+        syscalls at all. Directories are always descended into.
+
+    """
+
+    skip = set(skip)
+    to_lock = [root]
+
+    while to_lock:
+        dir_path = to_lock.pop()
+
+        if scandir is not None:
+            for entry in scandir(dir_path):
+                if entry.is_symlink():
+                    continue
+                if entry.is_dir():
+                    to_lock.append(entry.path)
+                elif entry.path not in skip:
+                    os.chmod(entry.path, locked_mode(entry.stat().st_mode))
+        else:
+            for name in os.listdir(dir_path):
+                path = os.path.join(dir_path, name)
+                st = os.lstat(path)
+                if stat.S_ISLNK(st.st_mode):
+                    continue
+                if stat.S_ISDIR(st.st_mode):
+                    to_lock.append(path)
+                elif path not in skip:
+                    os.chmod(path, locked_mode(st.st_mode))
+
+        if dir_path == root:
+            os.chmod(dir_path, locked_mode(0, True) | stat.S_ISVTX | stat.S_IWUSR)
+        else:
+            os.chmod(dir_path, locked_mode(0, True))
+
+
+def hash_file(path, algorithm):
+    """Get the hex digest of a file's contents."""
+    hasher = hashlib.new(algorithm)
+    with open(path, 'rb') as fh:
+        while True:
+            chunk = fh.read(_chunk_size)
+            if not chunk:
+                break
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def copy_and_hash(src_path, dst_path, algorithm, lock=False, throttle=None):
+    """Copy a file (and its mode), hashing the same buffers that are written.
+
+    :param str algorithm: The :mod:`hashlib` algorithm, or ``None`` to not hash.
+    :param bool lock: Make the copy read-only.
+    :param throttle: A :class:`~sgpublish.throttle.Throttle` to pass each
+        buffer through.
+    :returns: The hex digest of the file's contents, or ``None``.
+
+    """
+    hasher = hashlib.new(algorithm) if algorithm else None
+    with open(src_path, 'rb') as src_fh:
+        with open(dst_path, 'wb') as dst_fh:
+            while True:
+                chunk = src_fh.read(_chunk_size)
+                if not chunk:
+                    break
+                if throttle is not None:
+                    throttle.consume(len(chunk))
+                if hasher is not None:
+                    hasher.update(chunk)
+                dst_fh.write(chunk)
+            mode = stat.S_IMODE(os.fstat(src_fh.fileno()).st_mode)
+            os.fchmod(dst_fh.fileno(), locked_mode(mode) if lock else mode)
+    return hasher.hexdigest() if hasher is not None else None
+
+
+def hardlink(src_path, dst_path, lock=False):
+    """Link the destination to the same inode as the source.
+
+    The two paths will share permissions, so :class:`.Publisher` locking will
+    also apply to the source (unless it is already read-only).
+
+    """
+    os.link(src_path, dst_path)
+    if lock:
+        mode = os.stat(dst_path).st_mode
+        if mode & _writable_mask:
+            os.chmod(dst_path, locked_mode(mode))
+
+
+def reflink(src_path, dst_path, lock=False):
+    """Clone the source via a copy-on-write ``FICLONE`` ioctl (e.g. Btrfs, XFS)."""
+
+    if fcntl is None:
+        raise OSError(errno.ENOSYS, 'reflinks are not supported on this platform')
+
+    with open(src_path, 'rb') as src_fh:
+        with open(dst_path, 'wb') as dst_fh:
+            try:
+                fcntl.ioctl(dst_fh.fileno(), _FICLONE, src_fh.fileno())
+            except IOError as e:
+                # So the next strategy doesn't find an empty file.
+                os.unlink(dst_path)
+                raise OSError(e.errno, e.strerror, dst_path)
+
+    _set_mode(src_path, dst_path, lock)
+
+
+def auto(src_path, dst_path, algorithm=None, lock=False, throttle=None):
+    """Use the cheapest strategy which works for these paths.
+
+    Tries a reflink, then a hardlink, and finally falls back to a userspace
+    copy. Hardlinks are only used for sources which are already read-only
+    (e.g. from another publish), since permissions are shared with the source.
+
+    :returns: ``(method, digest)``; see :func:`transfer`.
+
+    """
+
+    strategies = [('reflink', reflink)]
+    if not os.stat(src_path).st_mode & _writable_mask:
+        strategies.append(('hardlink', hardlink))
+
+    for name, func in strategies:
+        try:
+            func(src_path, dst_path, lock)
+        except OSError as e:
+            if e.errno not in _unsupported_errnos:
+                raise
+            log.debug('%s not supported for %s: %s' % (name, dst_path, e))
+            # So the next strategy doesn't write through whatever this left.
+            if os.path.lexists(dst_path):
+                os.unlink(dst_path)
+        else:
+            return name, None
+
+    return _copy(src_path, dst_path, algorithm, lock, throttle)
+
+
+def _copy(src_path, dst_path, algorithm, lock, throttle=None):
+    if algorithm or throttle is not None:
+        return 'copy', copy_and_hash(src_path, dst_path, algorithm, lock, throttle)
+    shutil.copyfile(src_path, dst_path)
+    _set_mode(src_path, dst_path, lock)
+    return 'copy', None
+
+
+def transfer(src_path, dst_path, method, algorithm=None, lock=False, throttle=None):
+    """Get ``src_path`` to ``dst_path`` via the named method.
+
+    :param str method: One of :data:`METHODS`.
+    :param str algorithm: A :mod:`hashlib` algorithm to checksum the file with.
+        Only copies are hashed, as the data is written; other methods would
+        have to read the file once more, so they are not.
+    :param bool lock: Make the file read-only. Placeholders are never locked.
+    :param throttle: A :class:`~sgpublish.throttle.Throttle` for the bytes
+        which are copied.
+    :returns: ``(method, digest)``, where ``method`` is the one which was
+        actually used, and ``digest`` is ``None`` unless the file was copied
+        with an ``algorithm``.
+
+    """
+
+    if method == 'placeholder':
+        return method, None # Just a placeholder.
+    elif method == 'copy':
+        return _copy(src_path, dst_path, algorithm, lock, throttle)
+    elif method == 'auto':
+        return auto(src_path, dst_path, algorithm, lock, throttle)
+    elif method == 'move':
+        shutil.move(src_path, dst_path)
+        if lock and not os.path.isdir(dst_path):
+            os.chmod(dst_path, locked_mode(os.stat(dst_path).st_mode))
+    elif method == 'hardlink':
+        hardlink(src_path, dst_path, lock)
+    elif method == 'reflink':
+        reflink(src_path, dst_path, lock)
+    else:
+        raise RuntimeError('bad transfer method %r' % method)
+
+    return method, None
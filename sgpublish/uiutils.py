@@ -61,6 +61,33 @@ def announce_publish_success(
     msg.exec_()
 
 
+_thumbnails = {}
+def thumbnail(path, width):
+    """Load a thumbnail scaled to the given width, or ``None`` if it doesn't exist.
+
+    Decoded thumbnails are cached until their file changes, so pickers can
+    flip between publishes without reloading them.
+
+    """
+
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return
+
+    key = (path, width)
+    cached = _thumbnails.get(key)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+
+    if len(_thumbnails) > 256:
+        _thumbnails.clear()
+
+    pixmap = Q.QPixmap(path).scaledToWidth(width, Q.SmoothTransformation)
+    _thumbnails[key] = (mtime, pixmap)
+    return pixmap
+
+
 _icons_by_name = {}
 def icon(name, size=None, as_icon=False):
     
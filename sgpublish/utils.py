@@ -15,6 +15,31 @@ def makedirs(path):
             raise
 
 
+def get_size(path):
+    """Get the total size in bytes of a file, or of all files in a directory."""
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+    size = 0
+    for dir_path, dir_names, file_names in os.walk(path):
+        for file_name in file_names:
+            size += os.path.getsize(os.path.join(dir_path, file_name))
+    return size
+
+
+def format_bytes(size):
+    """Format a number of bytes for humans.
+
+    >>> format_bytes(1536)
+    '1.5kB'
+
+    """
+    for unit in ('B', 'kB', 'MB', 'GB', 'TB'):
+        if abs(size) < 1024 or unit == 'TB':
+            break
+        size /= 1024.0
+    return ('%d%s' if unit == 'B' else '%.1f%s') % (size, unit)
+
+
 def strip_version(name):
     return re.sub(r'_v\d+(_r\d+)', '', name)
 
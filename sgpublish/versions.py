@@ -1,9 +1,13 @@
-from concurrent.futures import ThreadPoolExecutor
+import collections
 import warnings
 
 from metatools.deprecate import FunctionRenamedWarning
 from sgfs import SGFS
 
+from . import executors
+from . import governor
+from . import tagcache
+
 
 
 GENERIC_FIELDS = (
@@ -22,6 +26,46 @@ SPECIFIC_FIELDS = (
     'sg_qt',
 )
 
+#: Every field of a Publish that promotion reads, including those of its Task
+#: and the Task's entity and Step, so that they are fetched in one request.
+PROMOTION_FIELDS = GENERIC_FIELDS + SPECIFIC_FIELDS + (
+    'sg_link.Task.step',
+    'sg_link.Task.step.Step.code',
+)
+
+
+def _has_field(entity, field):
+    # Deep fields are merged into the linked entities, so walk them.
+    # E.g. "sg_link.Task.step.Step.code" is at ['sg_link']['step']['code'].
+    value = entity
+    for name in field.split('.')[::2]:
+        if value is None:
+            return True # Nothing is linked, so there is nothing to fetch.
+        if name not in value:
+            return False
+        value = value[name]
+    return True
+
+
+def fetch_promotion_fields(publishes):
+    """Fetch the :data:`PROMOTION_FIELDS` of Publishes which don't have them.
+
+    All Publishes (which must share a session) are fetched in one request.
+
+    """
+
+    to_fetch = [
+        publish for publish in publishes
+        if not all(_has_field(publish, field) for field in PROMOTION_FIELDS)
+    ]
+    if not to_fetch:
+        return
+
+    session = to_fetch[0].session
+    governor.call_idempotent(session.find, 'PublishEvent', [
+        ('id', 'in', [publish['id'] for publish in to_fetch]),
+    ], PROMOTION_FIELDS)
+
 
 def generic_version_from_publish(publish, sgfs=None):
     """Get the generic fields for a Version that is derived from a Publish.
@@ -31,7 +75,7 @@ def generic_version_from_publish(publish, sgfs=None):
 
     """
 
-    publish.fetch(GENERIC_FIELDS)
+    fetch_promotion_fields([publish])
 
     fields = {
         'entity': publish['sg_link']['entity'],
@@ -43,12 +87,10 @@ def generic_version_from_publish(publish, sgfs=None):
 
     # Look up Maya frame information from the tag.
     sgfs = sgfs or SGFS(session=publish.session)
-    publish_path = sgfs.path_for_entity(publish)
-
-    tags = sgfs.get_directory_entity_tags(publish_path)
-    if tags and 'maya' in tags[0]:
-        min_time = tags[0]['maya']['min_time']
-        max_time = tags[0]['maya']['max_time']
+    _, tag = tagcache.get_entity_tag(sgfs, publish)
+    if tag and 'maya' in tag:
+        min_time = tag['maya']['min_time']
+        max_time = tag['maya']['max_time']
         fields.update({
             'sg_first_frame': int(min_time),
             'sg_last_frame': int(max_time),
@@ -66,6 +108,8 @@ def specific_version_from_publish(publish):
 
     """
 
+    fetch_promotion_fields([publish])
+
     return {
 
         'code': '%s_v%04d' % (publish['code'], publish['sg_version']),
@@ -79,24 +123,51 @@ def specific_version_from_publish(publish):
         'sg_frames_aspect_ratio': 1.0,
         'sg_movie_aspect_ratio': 1.0,
 
-        # I should be able to do this as a very deep fetch.
         # TODO: Remove in Western Post purge.
-        'sg_department': publish['sg_link']['step'].fetch('code') or 'Daily',
+        'sg_department': (publish['sg_link'].get('step') or {}).get('code') or 'Daily',
     }
 
 
 def create_versions_for_publish(publish, version_fields, sgfs=None):
+    """Create (or update) Versions which are derived from a Publish.
 
-    sgfs = sgfs or SGFS(session=publish.session)
-    generic_data = generic_version_from_publish(publish, sgfs=sgfs)
+    All Versions are written in one Shotgun batch request, their thumbnails
+    are shared in one more, and the Task and entity are then pointed at the
+    last of them in a final batch (which only writes each pointer once).
+
+    """
+    return create_versions_for_publishes([(publish, version_fields)], sgfs=sgfs)[0]
 
-    versions = []
 
-    # N.B. This used to be 4 threads, but it was causing collisions in
-    # Shotgun's servers.
-    with ThreadPoolExecutor(1) as executor:
+def create_versions_for_publishes(promotions, sgfs=None):
+    """Bulk :func:`create_versions_for_publish` for many Publishes at once.
+
+    The Publishes are fetched in one request, and all of their Versions are
+    written in one batch; only the sharing of thumbnails is done per Publish
+    (concurrently).
+
+    :param promotions: ``(publish, version_fields)`` pairs.
+    :returns: A list of the Versions of each pair.
+
+    """
+
+    promotions = [(publish, list(version_fields)) for publish, version_fields in promotions]
+    if not promotions:
+        return []
+
+    sgfs = sgfs or SGFS(session=promotions[0][0].session)
+    session = sgfs.session
+    fetch_promotion_fields([publish for publish, _ in promotions])
+
+    # N.B. This used to be 4 threads (and then 1), since too many was causing
+    # collisions in Shotgun's servers. The governor now finds the limit.
+    executor = executors.get('shotgun')
+
+    requests = []
+    for publish, version_fields in promotions:
+
+        generic_data = generic_version_from_publish(publish, sgfs=sgfs)
 
-        creation_futures = []
         for fields in version_fields:
 
             for key, value in generic_data.iteritems():
@@ -107,67 +178,113 @@ def create_versions_for_publish(publish, version_fields, sgfs=None):
             # when they need to modify existing ones.
             version_entity = fields.pop('__version_entity__', None)
             if version_entity is not None:
-                future = executor.submit(sgfs.session.update, 'Version', version_entity['id'], fields)
-                creation_futures.append((fields, version_entity, future))
+                requests.append({
+                    'request_type': 'update',
+                    'entity_type': 'Version',
+                    'entity_id': version_entity['id'],
+                    'data': fields,
+                })
             else:
                 # Can't put this in the generic fields cause we are only
                 # allowed to do it when creating an entity.
                 fields['created_by'] = publish['created_by']
-                future = executor.submit(sgfs.session.create, 'Version', fields)
-                creation_futures.append((fields, None, future))
-
-        final_futures = []
-        for fields, version_entity, future in creation_futures:
-            version_entity = version_entity or future.result()
-            versions.append(version_entity)
-
-            # Share thumbnails if the user didn't provide them.
-            if not fields.get('image'):
-                final_futures.append(executor.submit(sgfs.session.share_thumbnail,
-                    entities=[version_entity.minimal],
-                    source_entity=publish.minimal,
-                ))
-
-            # Set the status/version on the task.
-            # TODO: Make this optional when we revise the review process.
-            final_futures.append(executor.submit(sgfs.session.update,
-                'Task',
-                publish['sg_link']['id'],
-                {
-                    'sg_status_list': 'rev',
-                    'sg_latest_version': version_entity,
-                },
+                requests.append({
+                    'request_type': 'create',
+                    'entity_type': 'Version',
+                    'data': fields,
+                })
+
+    if not requests:
+        return [[] for _ in promotions]
+
+    results = iter(governor.call(session.batch, requests))
+    all_versions = [
+        [session.merge(next(results)) for _ in version_fields]
+        for _, version_fields in promotions
+    ]
+
+    final_futures = []
+
+    # The "latest" pointers of each Task and entity; when several Versions
+    # (or several Publishes of the same Task/entity) are promoted at once,
+    # only the last value is written.
+    latest_updates = collections.OrderedDict()
+
+    for (publish, version_fields), versions in zip(promotions, all_versions):
+
+        if not versions:
+            continue
+
+        # Share thumbnails if the user didn't provide them.
+        to_share = [
+            version.minimal
+            for fields, version in zip(version_fields, versions)
+            if not fields.get('image')
+        ]
+        if to_share:
+            final_futures.append(executor.submit(governor.call, session.share_thumbnail,
+                entities=to_share,
+                source_entity=publish.minimal,
             ))
-            
-            # Set the latest version on the entity.
-            # TODO: Make this optional when we revise the review process.
-            entity = publish['sg_link'].fetch('entity')
-            if entity['type'] in ('Asset', 'Shot'):
-                final_futures.append(executor.submit(sgfs.session.update,
-                    entity['type'],
-                    entity['id'],
-                    {'sg_latest_version': version_entity},
-                ))
 
-            # Allow them to raise if they must.
-            for future in final_futures:
-                future.result()
+        # Set the status/version on the task, and the latest version on the
+        # entity.
+        # TODO: Make this optional when we revise the review process.
+        latest = versions[-1]
+        latest_updates.setdefault(('Task', publish['sg_link']['id']), {}).update({
+            'sg_status_list': 'rev',
+            'sg_latest_version': latest,
+        })
+        entity = publish['sg_link']['entity']
+        if entity['type'] in ('Asset', 'Shot'):
+            latest_updates.setdefault((entity['type'], entity['id']), {}).update({
+                'sg_latest_version': latest,
+            })
+
+    if latest_updates:
+        final_futures.append(executor.submit(governor.call_idempotent, session.batch, [{
+            'request_type': 'update',
+            'entity_type': entity_type,
+            'entity_id': entity_id,
+            'data': data,
+        } for (entity_type, entity_id), data in latest_updates.iteritems()]))
 
-    return versions
+    # Allow them to raise if they must.
+    for future in final_futures:
+        future.result()
+
+    return all_versions
 
 
 def create_version_from_publish(publish, fields, sgfs=None):
     """Promote Publish into a single Version which generally mimicks that Publish.
 
     .. seealso:: :func:`create_versions`"""
+    return create_versions_from_publishes([publish], [fields], sgfs=sgfs)[0]
+
+
+def create_versions_from_publishes(publishes, fields=None, sgfs=None):
+    """Bulk :func:`create_version_from_publish` for many Publishes at once.
+
+    :param list publishes: The Publishes to promote.
+    :param list fields: Extra fields for the Version of each Publish.
+    :returns: A Version for each Publish.
+
+    """
 
-    publish.fetch(GENERIC_FIELDS + SPECIFIC_FIELDS)
+    publishes = list(publishes)
+    fields = list(fields) if fields is not None else [{} for _ in publishes]
+    fetch_promotion_fields(publishes)
 
-    specific_data = specific_version_from_publish(publish)
-    for key, value in specific_data.iteritems():
-        fields.setdefault(key, value)
+    for publish, version_fields in zip(publishes, fields):
+        specific_data = specific_version_from_publish(publish)
+        for key, value in specific_data.iteritems():
+            version_fields.setdefault(key, value)
 
-    return create_versions_for_publish(publish, [fields], sgfs=sgfs)[0]
+    all_versions = create_versions_for_publishes([
+        (publish, [version_fields]) for publish, version_fields in zip(publishes, fields)
+    ], sgfs=sgfs)
+    return [versions[0] for versions in all_versions]
 
 
 def promote_publish(publish, **fields):
@@ -1,9 +1,13 @@
 from pprint import pprint, pformat
 import datetime
+import errno
 import itertools
 import os
+import socket
 import sys
+import time
 
+import mock
 from mock import Mock
 
 from sgmock import Fixture
@@ -21,7 +25,13 @@ else:
 from sgsession import Session, Entity
 
 from sgfs import SGFS
-from sgpublish import Publisher
+import sgpublish.publisher
+from sgpublish import Publisher, publish_many
+from sgpublish import transfer
+from sgpublish.dedupe import ObjectStore
+from sgpublish.governor import Governor
+from sgpublish.manifest import Manifest
+from sgpublish.metadata import load as load_metadata
 
 from mayatools.test import requires_maya
 
@@ -84,6 +84,7 @@ class TestBasicPublisher(TestCase):
             republished_file = publisher.add_file(published_file)
 
         self.assertTrue(os.path.basename(republished_file), 'data_file.txt')
+        self.assertTrue('fetch_template' in publisher.timings)
         republish = publisher.entity
 
         self.assertEqual(republish.fetch('code'), 'test_publish_template')
@@ -91,4 +92,522 @@ class TestBasicPublisher(TestCase):
         self.assertEqual(republish.fetch('description'), 'THINGS!')
         self.assertEqual(republish.fetch('sg_source_publishes'), [template])
 
+    def test_parallel_copy(self):
 
+        src_dir = os.path.join(self.sandbox, 'parallel_src')
+        os.makedirs(src_dir)
+        src_paths = []
+        for i in xrange(20):
+            path = os.path.join(src_dir, 'file_%02d.txt' % i)
+            open(path, 'w').write('dummy file %d' % i)
+            src_paths.append(path)
+
+        with Publisher(name='test_parallel_copy', type='generic', link=self.task, sgfs=self.sgfs, copy_workers=4) as publisher:
+            publisher.add_files(src_paths, src_dir)
+
+        for i in xrange(20):
+            path = os.path.join(publisher.directory, 'file_%02d.txt' % i)
+            self.assertEqual(open(path).read(), 'dummy file %d' % i)
+
+    def test_republish_via_auto(self):
+
+        data_file = os.path.join(self.sandbox, 'data_file.txt')
+        open(data_file, 'w').write('this is a dummy file')
+
+        with Publisher(name='test_auto_source', type='generic', link=self.task, sgfs=self.sgfs, lock_permissions=True) as publisher:
+            published_file = publisher.add_file(data_file)
+
+        with Publisher(name='test_auto_republish', type='republish', link=self.task, sgfs=self.sgfs) as publisher:
+            republished_file = publisher.add_file(published_file, method='auto')
+
+        self.assertEqual(open(republished_file).read(), 'this is a dummy file')
+
+        method = Manifest.load(publisher.directory).files['data_file.txt']['method']
+        self.assertTrue(method in ('reflink', 'hardlink', 'copy'))
+
+        # Per-file methods are kept out of the tag.
+        tags = self.sgfs.get_directory_entity_tags(publisher.directory)
+        self.assertFalse('methods' in tags[0]['sgpublish'])
+
+    def test_auto_does_not_write_through_failed_link(self):
+
+        src_path = os.path.join(self.sandbox, 'linked_source.txt')
+        open(src_path, 'w').write('this is a dummy file')
+        os.chmod(src_path, 0444)
+        dst_path = os.path.join(self.sandbox, 'linked_dest.txt')
+
+        def reflink(src_path, dst_path, lock=False):
+            raise OSError(errno.EOPNOTSUPP, 'not supported', dst_path)
+
+        # Fails after the link exists, like a chmod of someone else's file.
+        def hardlink(src_path, dst_path, lock=False):
+            os.link(src_path, dst_path)
+            raise OSError(errno.EPERM, 'not permitted', dst_path)
+
+        with mock.patch.object(transfer, 'reflink', reflink):
+            with mock.patch.object(transfer, 'hardlink', hardlink):
+                method, digest = transfer.auto(src_path, dst_path, lock=True)
+
+        self.assertEqual(method, 'copy')
+        self.assertNotEqual(os.stat(src_path).st_ino, os.stat(dst_path).st_ino)
+        self.assertEqual(open(dst_path).read(), 'this is a dummy file')
+        self.assertEqual(os.stat(src_path).st_mode & 0777, 0444)
+
+    def test_hardlink_leaves_locked_source_alone(self):
+
+        src_path = os.path.join(self.sandbox, 'locked_source.txt')
+        open(src_path, 'w').write('this is a dummy file')
+        os.chmod(src_path, 0440)
+
+        with mock.patch('os.chmod') as chmod:
+            transfer.hardlink(src_path, os.path.join(self.sandbox, 'locked_dest.txt'), lock=True)
+        self.assertFalse(chmod.called)
+
+    def test_moved_directory_is_locked(self):
+
+        src_dir = os.path.join(self.sandbox, 'moved_dir')
+        os.makedirs(os.path.join(src_dir, 'sub'))
+        open(os.path.join(src_dir, 'a.txt'), 'w').write('a')
+        open(os.path.join(src_dir, 'sub', 'b.txt'), 'w').write('b')
+
+        with Publisher(name='test_moved_dir', type='generic', link=self.task, sgfs=self.sgfs, lock_permissions=True) as publisher:
+            dst_dir = publisher.add_file(src_dir, method='move')
+
+        for path in (os.path.join(dst_dir, 'a.txt'), os.path.join(dst_dir, 'sub', 'b.txt')):
+            self.assertFalse(os.stat(path).st_mode & 0222, path)
+
+    def test_dedupe(self):
+
+        data_file = os.path.join(self.sandbox, 'dedupe_file.txt')
+        open(data_file, 'w').write('this is a dummy file')
+
+        store = ObjectStore(os.path.join(self.sandbox, 'objects'))
+
+        published = []
+        for i in xrange(2):
+            with Publisher(name='test_dedupe', type='generic', link=self.task, sgfs=self.sgfs, dedupe=store) as publisher:
+                published.append(publisher.add_file(data_file))
+
+        self.assertEqual(open(published[1]).read(), 'this is a dummy file')
+        self.assertEqual(os.stat(published[0]).st_ino, os.stat(published[1]).st_ino)
+        self.assertEqual(store.collect_garbage(), (0, 0))
+
+    def test_manifest(self):
+
+        data_file = os.path.join(self.sandbox, 'manifest_file.txt')
+        open(data_file, 'w').write('this is a dummy file')
+
+        with Publisher(name='test_manifest', type='generic', link=self.task, sgfs=self.sgfs) as publisher:
+            published_file = publisher.add_file(data_file)
+
+        manifest = Manifest.find(published_file)
+        self.assertEqual(manifest.directory, publisher.directory)
+        self.assertEqual(manifest.files['manifest_file.txt']['size'], 20)
+        self.assertEqual(manifest.verify(deep=True), [])
+
+    def test_manifest_does_not_reread_exports(self):
+
+        data_file = os.path.join(self.sandbox, 'manifest_copied.txt')
+        open(data_file, 'w').write('this is a dummy file')
+
+        with mock.patch('sgpublish.manifest.hash_file') as hash_file:
+            with Publisher(name='test_manifest_exports', type='generic', link=self.task, sgfs=self.sgfs) as publisher:
+                publisher.add_file(data_file)
+                open(os.path.join(publisher.directory, 'exported.txt'), 'w').write('written by an exporter')
+        self.assertFalse(hash_file.called)
+
+        manifest = Manifest.load(publisher.directory)
+        self.assertTrue(manifest.files['manifest_copied.txt']['digest'])
+        self.assertEqual(manifest.files['exported.txt'], {'size': 22, 'digest': None, 'method': None})
+        self.assertEqual(manifest.verify(deep=True), [])
+
+    def test_staged_publish(self):
+
+        data_file = os.path.join(self.sandbox, 'staged_file.txt')
+        open(data_file, 'w').write('this is a dummy file')
+
+        with Publisher(name='test_staged', type='generic', link=self.task, sgfs=self.sgfs, staged=True) as publisher:
+            staging_directory = publisher.directory
+            self.assertNotEqual(staging_directory, publisher.final_directory)
+            publisher.add_file(data_file)
+            publisher.path = 'staged_file.txt'
+
+        self.assertFalse(os.path.exists(staging_directory))
+        self.assertEqual(publisher.directory, publisher.final_directory)
+        self.assertEqual(publisher.path, os.path.join(publisher.directory, 'staged_file.txt'))
+        self.assertEqual(open(publisher.path).read(), 'this is a dummy file')
+        self.assertEqual(publisher.entity.fetch('sg_path', force=True), publisher.path)
+
+    def test_deferred_staged_publish_is_empty_until_tagged(self):
+
+        data_file = os.path.join(self.sandbox, 'deferred_file.txt')
+        open(data_file, 'w').write('this is a dummy file')
+
+        publisher = Publisher(name='test_deferred_staged', type='generic', link=self.task, sgfs=self.sgfs,
+            staged=True, defer_entities=True)
+        publisher.add_file(data_file)
+
+        # Shotgun must not point at the publish while its files are copied.
+        seen = []
+        copy_files = publisher._copy_files
+        def _copy_files():
+            seen.append(self.sg.find_one('PublishEvent', [('id', 'is', publisher.entity['id'])], ['sg_version', 'sg_path']))
+            copy_files()
+        publisher._copy_files = _copy_files
+
+        publisher.commit()
+
+        self.assertEqual(seen[0]['sg_version'], 0)
+        self.assertEqual(seen[0]['sg_path'], None)
+        self.assertEqual(publisher.entity.fetch('sg_version', force=True), 1)
+
+    def test_automatic_version(self):
+
+        data_file = os.path.join(self.sandbox, 'version_file.txt')
+        open(data_file, 'w').write('this is a dummy file')
+
+        for i in xrange(3):
+            with Publisher(name='test_version', type='generic', link=self.task, sgfs=self.sgfs, cache_version=bool(i)) as publisher:
+                publisher.add_file(data_file)
+            self.assertEqual(publisher.version, i + 1)
+
+
+    def test_batch_publish(self):
+
+        data_file = os.path.join(self.sandbox, 'batch_file.txt')
+        open(data_file, 'w').write('this is a dummy file')
+
+        specs = [dict(name='test_batch_%d' % (i % 2), type='generic', link=self.task) for i in xrange(4)]
+        with publish_many(specs, sgfs=self.sgfs) as batch:
+            for publisher in batch:
+                publisher.add_file(data_file)
+
+        self.assertEqual([p.version for p in batch], [1, 1, 2, 2])
+        for publisher in batch:
+            self.assertTrue(publisher.id)
+            self.assertEqual(publisher.entity.fetch('sg_version', force=True), publisher.version)
+            self.assertTrue(os.path.exists(os.path.join(publisher.directory, 'batch_file.txt')))
+
+    def test_unique_directory(self):
+
+        publisher = Publisher(name='test_unique', type='generic', link=self.task, sgfs=self.sgfs, makedirs=False)
+        base_path = next(publisher.iter_potential_directories())
+        os.makedirs(base_path)
+        os.makedirs(base_path + '_1')
+        os.makedirs(base_path + '_3')
+
+        paths = publisher.iter_potential_directories()
+        self.assertEqual(next(paths), base_path + '_2')
+        self.assertEqual(next(paths), base_path + '_4')
+        self.assertEqual(publisher.pick_unique_directory(), base_path + '_2')
+        self.assertEqual(publisher.pick_unique_directory(), base_path + '_4')
+
+    def test_add_files_scales_linearly(self):
+
+        src_dir = os.path.join(self.sandbox, 'frames')
+        os.makedirs(src_dir)
+
+        publisher = Publisher(name='test_frames', type='generic', link=self.task, sgfs=self.sgfs,
+            directory=os.path.join(self.sandbox, 'frames_out'), defer_entities=True)
+        paths = [os.path.join(src_dir, 'frame.%06d.exr' % i) for i in xrange(5000)]
+
+        with mock.patch('os.stat', wraps=os.stat) as stat:
+            with mock.patch('os.lstat', wraps=os.lstat) as lstat:
+                publisher.add_files(paths, make_unique=True, method='placeholder')
+        self.assertEqual(len(publisher._files), 5000)
+
+        # One round-trip to the filer per file, and no scans of the queue.
+        self.assertEqual(stat.call_count + lstat.call_count, 5000)
+
+    def test_file_exists_sees_exported_files(self):
+
+        publisher = Publisher(name='test_exported', type='generic', link=self.task, sgfs=self.sgfs,
+            directory=os.path.join(self.sandbox, 'exported'), defer_entities=True)
+        self.assertFalse(publisher.file_exists('exported.txt'))
+
+        # Written by an exporter, rather than via add_file.
+        open(os.path.join(publisher.directory, 'exported.txt'), 'w').write('exported')
+
+        self.assertTrue(publisher.file_exists('exported.txt'))
+        self.assertEqual(publisher.unique_name('exported.txt'), 'exported_1.txt')
+
+    def test_timings(self):
+
+        data_file = os.path.join(self.sandbox, 'timed_file.txt')
+        open(data_file, 'w').write('this is a dummy file')
+
+        handled = []
+        sgpublish.publisher.timing_handlers.append(handled.append)
+        try:
+            with Publisher(name='test_timings', type='generic', link=self.task, sgfs=self.sgfs) as publisher:
+                publisher.add_file(data_file)
+        finally:
+            sgpublish.publisher.timing_handlers.remove(handled.append)
+
+        self.assertEqual(handled, [publisher])
+        for phase in ('guess_user', 'version_lookup', 'fetch_core', 'create', 'pick_directory', 'copy', 'update', 'tag'):
+            self.assertTrue(phase in publisher.timings, phase)
+        self.assertEqual(publisher.counters['files_copied'], 1)
+        self.assertEqual(publisher.counters['bytes_copied'], 20)
+        self.assertTrue(publisher.counters['shotgun_requests'] >= 4)
+
+        tags = self.sgfs.get_directory_entity_tags(publisher.directory)
+        self.assertEqual(tags[0]['sgpublish']['counters']['bytes_copied'], 20)
+
+    def test_resume_publish(self):
+
+        src_dir = os.path.join(self.sandbox, 'resume_src')
+        os.makedirs(src_dir)
+        paths = []
+        for i in xrange(3):
+            path = os.path.join(src_dir, 'file_%d.txt' % i)
+            open(path, 'w').write('this is dummy file %d' % i)
+            paths.append(path)
+
+        publisher = Publisher(name='test_resume', type='generic', link=self.task, sgfs=self.sgfs, journal=True)
+        publisher.add_files(paths)
+
+        # Simulate dying after the first file was copied.
+        publisher._prepare_commit()
+        src_path, dst_path, method = publisher._files[0]
+        publisher._timed_add_file(src_path, dst_path, method)
+        mtime = os.path.getmtime(dst_path)
+
+        resumed = Publisher.resume(publisher.directory, sgfs=self.sgfs)
+        self.assertEqual(resumed.id, publisher.id)
+        self.assertEqual(resumed.directory, publisher.directory)
+        self.assertEqual(os.path.getmtime(dst_path), mtime)
+        self.assertEqual(resumed.counters['files_copied'], 2)
+        self.assertEqual(resumed.entity.fetch('sg_version', force=True), publisher.version)
+        self.assertEqual(Manifest.load(resumed.directory).verify(deep=True), [])
+        self.assertFalse(os.path.exists(os.path.join(resumed.directory, '.sgpublish.journal')))
+
+    def test_resume_keeps_options(self):
+
+        data_file = os.path.join(self.sandbox, 'resume_options.txt')
+        open(data_file, 'w').write('this is a dummy file')
+        thumbnail = os.path.join(self.sandbox, 'resume_thumbnail.jpg')
+        open(thumbnail, 'wb').write('not really a jpeg')
+
+        def downscale(src_path, dst_path, max_size):
+            open(dst_path, 'wb').write('small')
+            return dst_path
+
+        with mock.patch('sgpublish.thumbnails.downscale', side_effect=downscale) as downscale_mock:
+
+            publisher = Publisher(name='test_resume_options', type='generic', link=self.task, sgfs=self.sgfs,
+                journal=True, io_class='bulk', bandwidth='10M', checksums=False,
+                metadata_max_size=1234, thumbnail_max_size=64, thumbnail_path=thumbnail)
+            publisher.add_file(data_file)
+
+            # Simulate dying after the small thumbnail was made.
+            publisher._prepare_commit()
+            publisher._small_thumbnail_future.result()
+            small_name = publisher._small_thumbnail_name
+
+            resumed = Publisher.resume(publisher.directory, sgfs=self.sgfs)
+
+        self.assertEqual(resumed.io_class, 'bulk')
+        self.assertEqual(resumed._throttle.rate, 10 * 1024 * 1024)
+        self.assertEqual(resumed._checksum_algorithm, None)
+        self.assertEqual(resumed.metadata_max_size, 1234)
+        self.assertEqual(resumed.thumbnail_max_size, 64)
+        self.assertEqual(resumed.copy_workers, publisher.copy_workers)
+
+        # The small thumbnail was remade in place, rather than beside itself.
+        self.assertEqual(resumed._small_thumbnail_name, small_name)
+        self.assertEqual(downscale_mock.call_args[0][2], 64)
+        self.assertEqual(sorted(x for x in os.listdir(resumed.directory) if 'small' in x), [small_name])
+
+    def test_commit_async(self):
+
+        data_file = os.path.join(self.sandbox, 'async_file.txt')
+        open(data_file, 'w').write('this is a dummy file')
+
+        progress = []
+        publisher = Publisher(name='test_async', type='generic', link=self.task, sgfs=self.sgfs)
+        publisher.add_file(data_file)
+        future = publisher.commit_async(lambda *args: progress.append(args[1:]))
+
+        self.assertTrue(future.result() is publisher)
+        self.assertEqual(progress[0], ('copy', 1, 1))
+        self.assertEqual(progress[-1], ('done', 0, 0))
+        self.assertEqual(publisher.entity.fetch('sg_version', force=True), publisher.version)
+        self.assertRaises(ValueError, publisher.commit_async)
+
+    def test_throttled_publish(self):
+
+        data_file = os.path.join(self.sandbox, 'throttled_file.bin')
+        open(data_file, 'wb').write(os.urandom(3 * 1024 * 1024))
+
+        start_time = time.time()
+        with Publisher(name='test_throttled', type='generic', link=self.task, sgfs=self.sgfs, io_class='bulk', bandwidth='1M') as publisher:
+            publisher.add_file(data_file)
+        self.assertEqual(publisher.io_class, 'bulk')
+        self.assertEqual(publisher.copy_workers, 1)
+
+        # The first second's worth is a free burst.
+        self.assertTrue(time.time() - start_time >= 2)
+
+    def test_preflight(self):
+
+        data_file = os.path.join(self.sandbox, 'preflight_file.txt')
+        open(data_file, 'w').write('this is a dummy file')
+
+        publisher = Publisher(name='test_preflight', type='generic', link=self.task, sgfs=self.sgfs)
+        publisher.add_file(data_file)
+        publisher.add_file(data_file, 'placeholder.txt', method='placeholder')
+        self.assertEqual(publisher.estimated_bytes, None)
+        self.assertEqual(publisher.preflight(), 20)
+        self.assertEqual(publisher.estimated_bytes, 20)
+
+        with mock.patch('os.statvfs') as statvfs:
+            statvfs.return_value = Mock(f_bavail=1, f_frsize=10)
+            try:
+                publisher.commit()
+            except OSError as e:
+                self.assertEqual(e.errno, errno.ENOSPC)
+            else:
+                self.fail('did not raise ENOSPC')
+
+        # The empty directory is released, rather than moved aside.
+        self.assertEqual(publisher.entity.get('id'), None)
+        self.assertFalse(os.path.exists(publisher.directory))
+        self.assertFalse(publisher.directory.endswith('.failed'))
+
+    def test_small_thumbnail(self):
+
+        thumbnail_path = os.path.join(self.sandbox, 'thumbnail_source.jpg')
+        open(thumbnail_path, 'w').write('this is a big thumbnail')
+
+        def downscale(src_path, dst_path, max_size):
+            open(dst_path, 'w').write('small')
+            return dst_path
+
+        self.session.upload_thumbnail = Mock()
+        with mock.patch('sgpublish.thumbnails.downscale', side_effect=downscale):
+            with Publisher(name='test_thumbnail', type='generic', link=self.task, sgfs=self.sgfs, thumbnail_path=thumbnail_path) as publisher:
+                pass
+
+        small_path = os.path.join(publisher.directory, 'thumbnail_small.jpg')
+        self.assertEqual(open(small_path).read(), 'small')
+        self.session.upload_thumbnail.assert_called_once_with('PublishEvent', publisher.id, small_path)
+
+        tags = self.sgfs.get_directory_entity_tags(publisher.directory)
+        self.assertEqual(tags[0]['sgpublish']['thumbnail'], 'thumbnail.jpg')
+        self.assertEqual(tags[0]['sgpublish']['thumbnail_small'], 'thumbnail_small.jpg')
+
+    def test_metadata_sidecar(self):
+
+        with Publisher(name='test_metadata', type='generic', link=self.task, sgfs=self.sgfs, metadata_max_size=1000) as publisher:
+            publisher.metadata['small'] = {'version': 2016}
+            publisher.metadata['large'] = dict(('key_%d' % i, 'value') for i in xrange(100))
+
+        encoded = publisher.entity.fetch('sg_metadata', force=True)
+        self.assertTrue(len(encoded) <= 1000)
+        meta = load_metadata(encoded)
+        self.assertEqual(meta.summary['small'], {'version': 2016})
+        self.assertTrue(len(meta.summary['large']) < 100)
+        self.assertEqual(meta['large']['key_99'], 'value')
+        self.assertTrue(os.path.exists(meta.path))
+
+    def test_batch_rollback(self):
+
+        specs = [dict(name='test_batch_rollback_%d' % i, type='generic', link=self.task) for i in xrange(3)]
+        batch = publish_many(specs, sgfs=self.sgfs)
+        ids = [publisher.id for publisher in batch]
+        directories = [publisher.directory for publisher in batch]
+        for publisher in batch:
+            publisher.entity['sg_version'] = publisher.version # As if the update was sent.
+
+        try:
+            with batch:
+                raise ValueError('export failed')
+        except ValueError:
+            pass
+
+        for publisher, id_, directory in zip(batch, ids, directories):
+            self.assertEqual(publisher.entity.get('id'), None)
+            self.assertEqual(publisher.directory, '%s.%d.failed' % (directory, id_))
+            self.assertTrue(os.path.exists(publisher.directory))
+            self.assertFalse(os.path.exists(directory))
+            publish = self.session.find_one('PublishEvent', [('id', 'is', id_)], ['sg_version'])
+            self.assertEqual(publish['sg_version'], 0)
+
+    def test_batch_releases_directories_of_bad_spec(self):
+
+        specs = [dict(name='test_batch_bad_spec_%d' % i, type='generic', link=self.task) for i in xrange(3)]
+        specs[2]['not_an_option'] = True
+
+        reserved = []
+        class RecordingPublisher(Publisher):
+            def __init__(self, *args, **kwargs):
+                super(RecordingPublisher, self).__init__(*args, **kwargs)
+                reserved.append(self.directory)
+
+        with mock.patch('sgpublish.batch.Publisher', RecordingPublisher):
+            self.assertRaises(TypeError, publish_many, specs, sgfs=self.sgfs)
+
+        self.assertEqual(len(reserved), 2)
+        for directory in reserved:
+            self.assertFalse(os.path.exists(directory))
+
+    def test_governor(self):
+
+        governor = Governor(initial=2, maximum=4, retries=2)
+
+        # Grows by one per window of successes, up to the maximum.
+        for i in xrange(20):
+            governor.call(lambda: None)
+        self.assertEqual(governor.limit, 4)
+
+        calls = []
+        def flaky():
+            calls.append(1)
+            if len(calls) < 3:
+                raise socket.error(errno.ECONNRESET, 'connection reset')
+            return 'ok'
+
+        # Idempotent calls are retried, and the limit halved per failure.
+        with mock.patch('time.sleep') as sleep:
+            self.assertEqual(governor.call_idempotent(flaky), 'ok')
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(sleep.call_count, 2)
+        self.assertEqual(governor.limit, 2) # 4 -> 2 -> 1, then grew on success.
+        self.assertEqual(governor.stats()['retries'], 2)
+
+        # Others are not.
+        del calls[:]
+        self.assertRaises(socket.error, governor.call, flaky)
+        self.assertEqual(len(calls), 1)
+
+        # Local errors are not Shotgun's, so are neither retried nor backed off.
+        limit = governor.limit
+        def missing_file():
+            raise IOError(errno.ENOENT, 'no such file')
+        self.assertRaises(IOError, governor.call_idempotent, missing_file)
+        self.assertEqual(governor.limit, limit)
+
+    def test_governor_latency_per_kind(self):
+
+        governor = Governor(initial=4, maximum=4, spike_floor=0)
+        clock = [0]
+
+        def find():
+            clock[0] += 0.01
+        def batch():
+            clock[0] += 10
+
+        with mock.patch('time.time', lambda: clock[0]):
+            for i in xrange(5):
+                governor.call(find)
+            # Batches are slow, but that isn't a sign of overload...
+            governor.call(batch)
+            governor.call(batch)
+            self.assertEqual(governor.limit, 4)
+            # ... while a slow find is.
+            def slow_find():
+                clock[0] += 1
+            slow_find.__name__ = 'find'
+            governor.call(slow_find)
+            self.assertEqual(governor.limit, 2)
@@ -37,3 +37,22 @@ class TestMayaScenePublish(TestCase):
         widget._description.setText('This is just a test.')
         dialog._on_submit()
         
+
+    @requires_maya(gui=True)
+    def test_submit_watches_background_commit(self):
+
+        dialog = publish_scene.run(testing=True)
+        publisher = Mock()
+
+        with mock.patch.object(dialog._publish_widget, 'export', return_value=publisher) as export:
+            dialog._on_submit()
+        self.assertTrue(export.call_args[1]['async_commit'])
+        self.assertEqual(publisher.commit_future.add_done_callback.call_count, 1)
+
+        # The result is announced from the main thread.
+        callback = publisher.commit_future.add_done_callback.call_args[0][0]
+        future = Mock()
+        future.exception.return_value = ValueError('commit failed')
+        with mock.patch('maya.utils.executeDeferred') as deferred:
+            callback(future)
+        deferred.assert_called_once_with(publish_scene._announce_commit, publisher, future)
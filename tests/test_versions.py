@@ -72,3 +72,125 @@ class TestVersions(TestCase):
 
         # TODO: There is a LOT more to assert here, but at least it ran!
 
+
+    def test_promote_many_batches_writes(self):
+
+        scene_path = os.path.join(self.sandbox, 'test_scene.ma')
+        open(scene_path, 'w').write('this is a dummy scene')
+
+        with Publisher(name='test_scene', type="maya_scene", link=self.task, sgfs=self.sgfs) as publisher:
+            publisher.add_file(scene_path)
+
+        with mock.patch.object(self.session, 'batch', wraps=self.session.batch) as batch:
+            with mock.patch.object(self.session, 'share_thumbnail') as share_thumbnail:
+                entities = versions.create_versions_for_publish(publisher.entity, [
+                    dict(code='version_a'),
+                    dict(code='version_b'),
+                    dict(code='version_c', image='/path/to/c.jpg'),
+                ], sgfs=self.sgfs)
+
+        # Every Version is written in the first batch...
+        requests = batch.call_args_list[0][0][0]
+        self.assertEqual([r['request_type'] for r in requests], ['create'] * 3)
+        self.assertEqual([e['code'] for e in entities], ['version_a', 'version_b', 'version_c'])
+
+        # ... and those without an image share the publish's in one request.
+        self.assertEqual(share_thumbnail.call_count, 1)
+        kwargs = share_thumbnail.call_args[1]
+        self.assertEqual([e['id'] for e in kwargs['entities']], [entities[0]['id'], entities[1]['id']])
+        self.assertEqual(kwargs['source_entity']['id'], publisher.entity['id'])
+
+    def test_promote_reads_cached_tag(self):
+
+        scene_path = os.path.join(self.sandbox, 'test_scene.ma')
+        open(scene_path, 'w').write('this is a dummy scene')
+
+        # Journaled, as removing the journal also modifies the directory.
+        with Publisher(name='test_scene', type="maya_scene", link=self.task, sgfs=self.sgfs, journal=True) as publisher:
+            publisher.add_file(scene_path)
+            publisher.metadata['maya'] = {'min_time': 1, 'max_time': 24}
+
+        # The tag written by the publisher is never read back.
+        with mock.patch.object(self.sgfs, 'get_directory_entity_tags') as get_tags:
+            with mock.patch.object(self.sgfs, 'path_for_entity') as path_for_entity:
+                fields = versions.generic_version_from_publish(publisher.entity, sgfs=self.sgfs)
+        self.assertFalse(get_tags.called)
+        self.assertFalse(path_for_entity.called)
+
+        self.assertEqual(fields['sg_first_frame'], 1)
+        self.assertEqual(fields['sg_last_frame'], 24)
+        self.assertEqual(fields['frame_count'], 24)
+
+    def test_promotion_fields_fetched_once(self):
+
+        scene_path = os.path.join(self.sandbox, 'test_scene.ma')
+        open(scene_path, 'w').write('this is a dummy scene')
+
+        with Publisher(name='test_scene', type="maya_scene", link=self.task, sgfs=self.sgfs) as publisher:
+            publisher.add_file(scene_path)
+
+        # A fresh session, which knows nothing of the publish.
+        session = Session(self.sg)
+        sgfs = SGFS(root=self.sandbox, session=session, schema_name='testing')
+        publish = session.merge(publisher.entity.minimal)
+
+        with mock.patch.object(session, 'find', wraps=session.find) as find:
+            versions.create_versions_for_publish(publish, [
+                dict(code='version_a'),
+                dict(code='version_b'),
+            ], sgfs=sgfs)
+            version = versions.create_version_from_publish(publish, {}, sgfs=sgfs)
+
+        publish_finds = [c for c in find.call_args_list if c[0][0] == 'PublishEvent']
+        self.assertEqual(len(publish_finds), 1)
+        self.assertEqual(version['sg_department'], 'Anm')
+        self.assertEqual(publish['sg_link']['entity']['id'], self.shot['id'])
+
+    def test_specific_fields_fetch_step(self):
+
+        scene_path = os.path.join(self.sandbox, 'test_scene.ma')
+        open(scene_path, 'w').write('this is a dummy scene')
+
+        with Publisher(name='test_scene', type="maya_scene", link=self.task, sgfs=self.sgfs) as publisher:
+            publisher.add_file(scene_path)
+
+        # Without prefetching the promotion fields.
+        session = Session(self.sg)
+        publish = session.merge(publisher.entity.minimal)
+        fields = versions.specific_version_from_publish(publish)
+
+        self.assertEqual(fields['code'], 'test_scene_v0001')
+        self.assertEqual(fields['sg_department'], 'Anm')
+
+    def _publish_scenes(self, names):
+        scene_path = os.path.join(self.sandbox, 'test_scene.ma')
+        open(scene_path, 'w').write('this is a dummy scene')
+        publishes = []
+        for name in names:
+            with Publisher(name=name, type="maya_scene", link=self.task, sgfs=self.sgfs) as publisher:
+                publisher.add_file(scene_path)
+            publishes.append(publisher.entity)
+        return publishes
+
+    def test_promote_many_publishes(self):
+
+        publishes = self._publish_scenes(('scene_a', 'scene_b', 'scene_c'))
+
+        with mock.patch.object(self.session, 'batch', wraps=self.session.batch) as batch:
+            entities = versions.create_versions_from_publishes(publishes, sgfs=self.sgfs)
+
+        # One batch of creates, and one of the latest pointers.
+        self.assertEqual(batch.call_count, 2)
+        self.assertEqual([e['code'] for e in entities], ['scene_a_v0001', 'scene_b_v0001', 'scene_c_v0001'])
+        for publish, entity in zip(publishes, entities):
+            self.assertEqual(entity['sg_publish']['id'], publish['id'])
+
+        # All publishes share a Task and Shot, which are each updated once,
+        # to the last Version.
+        updates = batch.call_args_list[-1][0][0]
+        self.assertEqual(sorted((u['entity_type'], u['entity_id']) for u in updates), [
+            ('Shot', self.shot['id']),
+            ('Task', self.task['id']),
+        ])
+        for update in updates:
+            self.assertEqual(update['data']['sg_latest_version']['id'], entities[-1]['id'])